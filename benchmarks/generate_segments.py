@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""Write synthetic ASCAT.sc, ichorCNA and ACE segment files for benchmarking."""
+
+import argparse
+from pathlib import Path
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bin"))
+
+from calculate_scnapattern import BUILTIN_GENOMES  # noqa: E402
+
+# Column layout of each caller, as found in their segment outputs. Only the
+# chromosome, position, copy number and sample columns are used by the
+# classifier; the others make the files as wide as the real ones.
+FORMATS = {
+    "ascat": {"sample": "sample", "chromosome": "chromosome",
+              "start": "start", "end": "end", "cn": "total_copy_number",
+              "extra": {"nMajor": "cn_major", "nMinor": "cn_minor"}},
+    "ichorcna": {"sample": "ID", "chromosome": "chrom", "start": "start",
+                 "end": "end", "cn": "copy.number",
+                 "extra": {"num.mark": "bins", "seg.median.logR": "logr",
+                           "call": "call", "logR_Copy_Number": "logr_cn",
+                           "Corrected_Copy_Number": "cn",
+                           "Corrected_Call": "call"}},
+    "ace": {"sample": None, "chromosome": "Chromosome", "start": "Start",
+            "end": "End", "cn": "Copies",
+            "extra": {"Num_Bins": "bins", "Segment_Mean": "logr",
+                      "Segment_Median": "logr"}},
+}
+
+CALLS = np.array(["HOMD", "HETD", "NEUT", "GAIN", "AMP", "HLAMP"])
+
+
+def sample_segments(rng: np.random.Generator, genome: str, segments: int,
+                    span_fraction: float = 0.1) -> pd.DataFrame:
+    """Random segmentation of one genome with about ``segments`` segments.
+
+    Breakpoints are spread over chromosomes by length. On a fraction of the
+    chromosomes no breakpoint falls near the centromere, so that one
+    segment spans both arms.
+    """
+
+    table = BUILTIN_GENOMES[genome]
+    names = list(table)
+    centromeres = np.array([table[name][0] for name in names])
+    lengths = np.array([table[name][1] for name in names])
+    counts = rng.multinomial(max(segments - len(names), 0),
+                             lengths / lengths.sum())
+
+    frames = []
+    for name, centromere, length, count in zip(names, centromeres, lengths,
+                                               counts):
+        breaks = rng.integers(1, length, size=count)
+        if rng.random() < span_fraction:
+            window = length // 20
+            breaks = breaks[np.abs(breaks - centromere) > window]
+        breaks = np.unique(breaks)
+        starts = np.r_[0, breaks]
+        ends = np.r_[breaks, length]
+        frames.append(pd.DataFrame({"chromosome": name, "start": starts,
+                                    "end": ends}))
+
+    result = pd.concat(frames, ignore_index=True)
+    # Mostly diploid, with occasional losses, gains and amplifications
+    result["cn"] = rng.choice([0, 1, 2, 3, 4, 6], size=len(result),
+                              p=[0.02, 0.15, 0.55, 0.18, 0.07, 0.03])
+
+    return result
+
+
+def format_segments(segments: pd.DataFrame, sample: str, file_format: str,
+                    style: str, rng: np.random.Generator) -> pd.DataFrame:
+
+    layout = FORMATS[file_format]
+    chromosomes = segments["chromosome"]
+    if style == "ncbi":
+        chromosomes = chromosomes.str.removeprefix("chr")
+
+    columns = {}
+    if layout["sample"]:
+        columns[layout["sample"]] = sample
+    columns[layout["chromosome"]] = chromosomes
+    columns[layout["start"]] = segments["start"]
+    columns[layout["end"]] = segments["end"]
+    columns[layout["cn"]] = segments["cn"]
+
+    n_rows = len(segments)
+    for column, kind in layout["extra"].items():
+        if kind == "bins":
+            columns[column] = (segments["end"] - segments["start"]) // 500_000 + 1
+        elif kind == "logr":
+            columns[column] = np.round(np.log2(np.maximum(segments["cn"], 0.1) / 2)
+                                       + rng.normal(0, 0.05, n_rows), 4)
+        elif kind == "call":
+            columns[column] = CALLS[np.clip(segments["cn"], 0, 5)]
+        elif kind == "logr_cn":
+            columns[column] = np.round(segments["cn"] + rng.normal(0, 0.1, n_rows), 4)
+        elif kind == "cn":
+            columns[column] = segments["cn"]
+        elif kind == "cn_major":
+            columns[column] = (segments["cn"] + 1) // 2
+        elif kind == "cn_minor":
+            columns[column] = segments["cn"] // 2
+
+    return pd.DataFrame(columns)
+
+
+def generate(destination: Path, file_format: str, samples: int,
+             segments: int, genome: str = "hg38", style: str = "ucsc",
+             pooled: bool = False, seed: int = 0) -> list[Path]:
+    """Write the synthetic cohort and a matching samplesheet.
+
+    Returns the written segment files: one per sample, or a single file
+    holding every sample with ``pooled``.
+    """
+
+    rng = np.random.default_rng(seed)
+    destination.mkdir(parents=True, exist_ok=True)
+    suffix = "seg" if file_format == "ichorcna" else "txt"
+
+    written = []
+    rows = []
+    for index in range(samples):
+        sample = f"SYN{index + 1:05d}"
+        table = format_segments(sample_segments(rng, genome, segments),
+                                sample, file_format, style, rng)
+        if pooled:
+            target = destination / f"pooled_{file_format}.{suffix}"
+            table.to_csv(target, sep="\t", index=False,
+                         mode="a" if index else "w", header=not index)
+            if not index:
+                written.append(target)
+        else:
+            target = destination / f"{sample}.{suffix}"
+            table.to_csv(target, sep="\t", index=False)
+            written.append(target)
+        rows.append({"sample": sample, "filename": target.resolve(),
+                     "ploidy": 2, "format": file_format})
+
+    pd.DataFrame(rows).to_csv(destination / "samplesheet.csv", index=False)
+
+    return written
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--format", choices=tuple(FORMATS), default="ascat")
+    parser.add_argument("--samples", type=int, default=1)
+    parser.add_argument("--segments", type=int, default=1000,
+                        help="Approximate segments per sample")
+    parser.add_argument("--genome", choices=tuple(BUILTIN_GENOMES),
+                        default="hg38")
+    parser.add_argument("--style", choices=("ucsc", "ncbi"), default="ucsc")
+    parser.add_argument("--pooled", action="store_true",
+                        help="Write all samples to a single file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("destination", type=Path)
+
+    options = parser.parse_args()
+
+    generate(options.destination, options.format, options.samples,
+             options.segments, genome=options.genome, style=options.style,
+             pooled=options.pooled, seed=options.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+"""Time each stage of calculate_scnapattern.py on synthetic cohorts.
+
+Every run is appended to a JSON-lines history together with the current
+git commit. Each stage is then compared with the latest run of the same
+scenario from a different commit, and the script exits with status 1 if
+any stage got slower than the allowed threshold.
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import janitor  # noqa: F401 (registers DataFrame.clean_names)
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bin"))
+
+import calculate_scnapattern as scna  # noqa: E402
+from generate_segments import generate  # noqa: E402
+
+# name: (format, samples, segments per sample, chromosome style of the files)
+SCENARIOS = {
+    "ascat-1x100": ("ascat", 1, 100, "ucsc"),
+    "ichorcna-1x10k": ("ichorcna", 1, 10_000, "ncbi"),
+    "ace-100x1k": ("ace", 100, 1_000, "ucsc"),
+    "ichorcna-1x1M": ("ichorcna", 1, 1_000_000, "ucsc"),
+    "ascat-10kx100": ("ascat", 10_000, 100, "ncbi"),
+}
+QUICK_SCENARIOS = ("ascat-1x100", "ichorcna-1x10k", "ace-100x1k")
+
+STAGES = ("read", "harmonize_columns", "normalized_scna_length",
+          "classification", "output")
+
+SCRIPT = Path(__file__).resolve().parent.parent / "bin" / "calculate_scnapattern.py"
+
+# Modules that --version and small inputs must not import
+HEAVY_MODULES = ("numpy", "pandas", "janitor")
+
+# Runs the script (argv after -c) in this interpreter, then reports its
+# wall time and the heavy modules it imported
+IMPORT_PROBE = f"""
+import json, runpy, sys, time
+sys.argv = sys.argv[1:]
+started = time.perf_counter()
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+print(json.dumps({{"seconds": time.perf_counter() - started,
+                  "modules": [name for name in {HEAVY_MODULES!r}
+                              if name in sys.modules]}}))
+"""
+
+
+def time_sample(path: Path, sample: str, file_format: str,
+                arm_data: pd.DataFrame, output: Path) -> dict[str, float]:
+
+    timings = {}
+
+    started = time.perf_counter()
+    segments = pd.read_table(path).clean_names()
+    timings["read"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    segments["sample"] = sample
+    segments = scna.prepare_segments(segments, file_format,
+                                     scna.arm_contigs(arm_data))
+    timings["harmonize_columns"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    segment_length = scna.normalized_scna_length(segments, arm_data)
+    timings["normalized_scna_length"] = time.perf_counter() - started
+
+    # What call_patterns does after the arm join, which is timed above
+    started = time.perf_counter()
+    table = scna.classify_patterns(scna.sample_summary(segment_length, 2))
+    timings["classification"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    table.to_csv(output, sep="\t", index=True)
+    timings["output"] = time.perf_counter() - started
+
+    return timings
+
+
+def run_scenario(name: str, repeats: int, workdir: Path) -> dict[str, float]:
+    """Best-of-``repeats`` seconds per stage, summed over the samples."""
+
+    file_format, samples, segments, style = SCENARIOS[name]
+    files = generate(workdir / name, file_format, samples, segments,
+                     style=style)
+    arm_data = scna.get_chromosomal_arm_lengths("hg38")
+
+    best = {}
+    for _ in range(repeats):
+        totals = dict.fromkeys(STAGES, 0.0)
+        for index, path in enumerate(files):
+            timings = time_sample(path, f"SYN{index + 1:05d}", file_format,
+                                  arm_data, workdir / "output.tsv")
+            for stage, seconds in timings.items():
+                totals[stage] += seconds
+        for stage, seconds in totals.items():
+            best[stage] = min(best.get(stage, seconds), seconds)
+
+    return best
+
+
+def check_imports(workdir: Path, threshold: float) -> list[str]:
+    """Run the script in fresh interpreters, as the pipeline does.
+
+    Neither --version nor a small single-sample input may import numpy,
+    pandas or pyjanitor, and each run must take under ``threshold``
+    seconds. Returns the failures.
+    """
+
+    sample = generate(workdir / "imports", "ascat", 1, 100)[0]
+    runs = {
+        "version": ["--version"],
+        "small_input": ["--file-format", "ascat", "--report-import-time",
+                        str(sample), str(workdir / "imports.tsv")],
+    }
+
+    failures = []
+    for name, arguments in runs.items():
+        completed = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE, str(SCRIPT), *arguments],
+            capture_output=True, text=True, check=True)
+        probe = json.loads(completed.stdout.splitlines()[-1])
+        print(f"import/{name} seconds={probe['seconds']:.4f}")
+        if probe["modules"]:
+            failures.append(f"import/{name}: imported "
+                            f"{', '.join(probe['modules'])}")
+        if probe["seconds"] > threshold:
+            failures.append(f"import/{name}: {probe['seconds']:.4f}s, over "
+                            f"the {threshold}s limit")
+
+    return failures
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def read_history(history: Path) -> list[dict]:
+    if not history.exists():
+        return []
+    with history.open() as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def find_regressions(record: dict, history: list[dict], threshold: float,
+                     noise_floor: float) -> list[str]:
+    """Compare a run with the latest run of its scenario on another commit."""
+
+    previous = [entry for entry in history
+                if entry["scenario"] == record["scenario"]
+                and entry["commit"] != record["commit"]]
+    if not previous:
+        return []
+    baseline = previous[-1]
+
+    regressions = []
+    for stage, seconds in record["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before is None or seconds - before < noise_floor:
+            continue
+        if seconds > before * (1 + threshold):
+            regressions.append(
+                f"{record['scenario']}/{stage}: {before:.4f}s at "
+                f"{baseline['commit']} -> {seconds:.4f}s")
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenario", action="append",
+                        choices=tuple(SCENARIOS),
+                        help="Scenario to run (repeatable; default: the "
+                        "quick set, or all with --full)")
+    parser.add_argument("--full", action="store_true",
+                        help="Run every scenario, up to 10k samples and "
+                        "1M segments")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--history", type=Path,
+                        default=Path(__file__).resolve().parent / "history.jsonl")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed relative slowdown per stage")
+    parser.add_argument("--noise-floor", type=float, default=0.005,
+                        help="Slowdowns below this many seconds are ignored")
+    parser.add_argument("--import-threshold", type=float, default=0.5,
+                        help="Longest run, in seconds, of --version or a "
+                        "small input (which must not import numpy, pandas "
+                        "or pyjanitor)")
+    options = parser.parse_args()
+
+    scenarios = options.scenario or (tuple(SCENARIOS) if options.full
+                                     else QUICK_SCENARIOS)
+    history = read_history(options.history)
+    commit = current_commit()
+
+    regressions = []
+    with tempfile.TemporaryDirectory(prefix="scnapattern_bench_") as workdir:
+        regressions.extend(check_imports(Path(workdir),
+                                         options.import_threshold))
+        for name in scenarios:
+            stages = run_scenario(name, options.repeats, Path(workdir))
+            record = {"commit": commit, "scenario": name,
+                      "timestamp": datetime.now(timezone.utc).isoformat(),
+                      "python": platform.python_version(),
+                      "pandas": pd.__version__, "stages": stages}
+            print(name, "  ".join(f"{stage}={seconds:.4f}s"
+                                  for stage, seconds in stages.items()))
+            regressions.extend(find_regressions(
+                record, history, options.threshold, options.noise_floor))
+            with options.history.open("a") as handle:
+                handle.write(json.dumps(record) + "\n")
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,255 +1,3810 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import argparse
+import bisect
+import contextlib
+import csv
+import functools
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import io
+import json
+import math
+import os
 from pathlib import Path
-from typing import Literal
+import queue
+import re
+import resource
+import signal
+import sys
+import tempfile
+import threading
+import time
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Callable, Literal, Mapping, NamedTuple
 import warnings
 
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
 warnings.simplefilter('ignore', category=DeprecationWarning)
 warnings.simplefilter('ignore', category=FutureWarning)
 
-import pandas as pd
-import janitor
-import pyranges as pr
-
 __version__ = "0.0.1"
 
 
-def get_chromosomal_arm_lengths(genome: str = "hg38") -> pd.DataFrame:
+class _LazyModule:
+    """Stand-in for a heavy module, imported on first attribute access.
+
+    numpy, pandas and pyjanitor take most of the start-up time, and are not
+    needed for --version, argument errors or the pure-Python path used for
+    small inputs.
+    """
+
+    load_seconds: dict[str, float] = {}
+
+    def __init__(self, name: str, companions: tuple[str, ...] = ()):
+        self._name = name
+        self._companions = companions
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            started = time.perf_counter()
+            module = importlib.import_module(self._name)
+            # pyjanitor registers its DataFrame methods on import
+            for companion in self._companions:
+                importlib.import_module(companion)
+            self.load_seconds[self._name] = time.perf_counter() - started
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+
+np = _LazyModule("numpy")
+pd = _LazyModule("pandas", companions=("janitor",))
+
+
+class _Stage:
+    __slots__ = ("rows", "output_rows")
+
+    def __init__(self):
+        self.rows = None
+        self.output_rows = None
+
+
+class StageProfiler:
+    """Wall time, CPU time, peak RSS and row counts per pipeline stage.
+
+    Stages that run several times (one per sample) are accumulated. When
+    disabled, ``stage`` costs a couple of attribute lookups.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+
+    def reset(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        stage = _Stage()
+        if not self.enabled:
+            yield stage
+            return
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield stage
+        finally:
+            record = self.stages.setdefault(
+                name, {"wall_seconds": 0.0, "cpu_seconds": 0.0,
+                       "peak_rss_mb": 0.0, "rows": 0, "calls": 0})
+            record["wall_seconds"] += time.perf_counter() - wall
+            record["cpu_seconds"] += time.process_time() - cpu
+            record["peak_rss_mb"] = max(record["peak_rss_mb"], _peak_rss_mb())
+            record["rows"] += stage.rows or 0
+            record["calls"] += 1
+            # Only stages that shrink their input report what they kept
+            if stage.output_rows is not None:
+                record["output_rows"] = (record.get("output_rows", 0)
+                                         + stage.output_rows)
+
+    def merge(self, stages: dict) -> None:
+        for name, other in stages.items():
+            record = self.stages.setdefault(name, dict.fromkeys(other, 0))
+            for key, value in other.items():
+                if key == "peak_rss_mb":
+                    record[key] = max(record[key], value)
+                else:
+                    record[key] = record.get(key, 0) + value
+
+    def write(self, path: str | Path, **metadata) -> None:
+
+        def ratios(record):
+            if record.get("output_rows"):
+                return {"compression_ratio": round(
+                    record["rows"] / record["output_rows"], 3)}
+            return {}
+
+        report = {"version": __version__, **metadata,
+                  "peak_rss_mb": _peak_rss_mb(),
+                  "stages": [{"name": name, **record, **ratios(record)}
+                             for name, record in self.stages.items()]}
+        with open(path, "w") as handle:
+            json.dump(report, handle, indent=2)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    return round(peak / scale, 2)
+
+
+PROFILER = StageProfiler()
+
+
+# Centromere position (end of the p arm) and chromosome length, as found in
+# the UCSC cytoBand tables for the supported assemblies
+BUILTIN_GENOMES = {
+    "hg19": {
+        "chr1": (125000000, 249250621), "chr2": (93300000, 243199373),
+        "chr3": (91000000, 198022430), "chr4": (50400000, 191154276),
+        "chr5": (48400000, 180915260), "chr6": (61000000, 171115067),
+        "chr7": (59900000, 159138663), "chr8": (45600000, 146364022),
+        "chr9": (49000000, 141213431), "chr10": (40200000, 135534747),
+        "chr11": (53700000, 135006516), "chr12": (35800000, 133851895),
+        "chr13": (17900000, 115169878), "chr14": (17600000, 107349540),
+        "chr15": (19000000, 102531392), "chr16": (36600000, 90354753),
+        "chr17": (24000000, 81195210), "chr18": (17200000, 78077248),
+        "chr19": (26500000, 59128983), "chr20": (27500000, 63025520),
+        "chr21": (13200000, 48129895), "chr22": (14700000, 51304566),
+        "chrX": (60600000, 155270560), "chrY": (12500000, 59373566),
+    },
+    "hg38": {
+        "chr1": (123400000, 248956422), "chr2": (93900000, 242193529),
+        "chr3": (90900000, 198295559), "chr4": (50000000, 190214555),
+        "chr5": (48800000, 181538259), "chr6": (59800000, 170805979),
+        "chr7": (60100000, 159345973), "chr8": (45200000, 145138636),
+        "chr9": (43000000, 138394717), "chr10": (39800000, 133797422),
+        "chr11": (53400000, 135086622), "chr12": (35500000, 133275309),
+        "chr13": (17700000, 114364328), "chr14": (17200000, 107043718),
+        "chr15": (19000000, 101991189), "chr16": (36800000, 90338345),
+        "chr17": (25100000, 83257441), "chr18": (18500000, 80373285),
+        "chr19": (26200000, 58617616), "chr20": (28100000, 64444167),
+        "chr21": (12000000, 46709983), "chr22": (15000000, 50818468),
+        "chrX": (60600000, 156040895), "chrY": (10400000, 57227415),
+    },
+}
+
+ARM_NAMES = ("p", "q")
+ARM_INDEX_VERSION = 1
+
+
+class ArmIndex(NamedTuple):
+    """Compiled arm table: sorted arrays plus the contig names they refer to."""
+    genome: str
+    contigs: tuple[str, ...]
+    arms: np.ndarray
+    checksum: str
+
+
+def _natural_key(name: str):
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r"(\d+)", name)]
+
+
+def default_cache_dir() -> Path:
+    location = os.environ.get("SCNAPATTERN_CACHE")
+    if location:
+        return Path(location)
+    return Path(os.environ.get("XDG_CACHE_HOME",
+                               Path.home() / ".cache")) / "scnapattern"
+
+
+def _builtin_bands(genome: str) -> list[tuple[str, str, int, int]]:
+
+    bands = []
+    for chrom, (centromere, length) in BUILTIN_GENOMES[genome].items():
+        bands.append((chrom, "p", 0, centromere))
+        bands.append((chrom, "q", centromere, length))
+
+    return bands
+
+
+def read_cytoband(path: str | Path) -> list[tuple[str, str, int, int]]:
+    """Collapse a UCSC-style cytoBand file (plain or gzipped) to arm extents."""
+
+    path = Path(path)
+    with path.open("rb") as handle:
+        compressed = handle.read(2) == b"\x1f\x8b"
+    opener = gzip.open if compressed else open
+
+    extents = {}
+    with opener(path, "rt") as handle:
+        for line in handle:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4 or not fields[3]:
+                continue
+            arm = fields[3][0]
+            if arm not in ARM_NAMES:
+                continue
+            key = (fields[0], arm)
+            start, end = int(fields[1]), int(fields[2])
+            if key in extents:
+                start = min(start, extents[key][0])
+                end = max(end, extents[key][1])
+            extents[key] = (start, end)
 
-    url = f"http://hgdownload.cse.ucsc.edu/goldenpath/{genome}/database/cytoBand.txt.gz"
-    table = (
-        pd.read_table(url, names=["chrom", "chromStart", "chromEnd",
-                                  "arm"," gieStain"])
-        .transform_column("arm", lambda x: x.str[0], elementwise=False)
-        .dropna(subset=["arm"])
-        .groupby(["chrom", "arm"], as_index=False )
-        .agg({"chromStart": "min", "chromEnd": "max"})
-        .sort_naturally("chrom")
-        .rename(columns={"chrom": "Chromosome", "chromStart": "Start",
-                         "chromEnd": "End", "arm": "Name"})
-    )
+    if not extents:
+        raise ValueError(f"No chromosome arms found in {path}")
+
+    return [(chrom, arm, start, end)
+            for (chrom, arm), (start, end) in extents.items()]
+
+
+def _bands_checksum(bands: list[tuple[str, str, int, int]]) -> str:
+
+    digest = hashlib.sha256(f"v{ARM_INDEX_VERSION}".encode())
+    for band in sorted(bands):
+        digest.update("\t".join(map(str, band)).encode() + b"\n")
+
+    return digest.hexdigest()
+
+
+def compile_arm_index(genome: str,
+                      bands: list[tuple[str, str, int, int]]) -> ArmIndex:
+
+    contigs = tuple(sorted({band[0] for band in bands}, key=_natural_key))
+    contig_ids = {name: idx for idx, name in enumerate(contigs)}
+    coordinate_type = "<u4" if max(band[3] for band in bands) < 2**32 else "<i8"
+    dtype = np.dtype([("contig", "<u2"), ("arm", "u1"),
+                      ("start", coordinate_type), ("end", coordinate_type)])
+
+    arms = np.array(
+        [(contig_ids[chrom], ARM_NAMES.index(arm), start, end)
+         for chrom, arm, start, end in bands], dtype=dtype)
+    arms.sort(order=["contig", "arm"])
+
+    return ArmIndex(genome, contigs, arms, _bands_checksum(bands))
+
+
+def _index_paths(genome: str, checksum: str,
+                 cache_dir: Path) -> tuple[Path, Path]:
+
+    stem = f"{genome}.{checksum[:16]}"
+    return cache_dir / f"{stem}.npy", cache_dir / f"{stem}.json"
+
+
+def _write_arm_index(index: ArmIndex, cache_dir: Path) -> None:
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    data_file, metadata_file = _index_paths(index.genome, index.checksum,
+                                            cache_dir)
+
+    # Write to temporary files and rename, so that concurrent tasks sharing
+    # the cache never see a partially written index
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".npy",
+                                     delete=False) as handle:
+        np.save(handle, index.arms, allow_pickle=False)
+    payload = hashlib.sha256(Path(handle.name).read_bytes()).hexdigest()
+    os.replace(handle.name, data_file)
+
+    metadata = {"version": ARM_INDEX_VERSION, "genome": index.genome,
+                "contigs": index.contigs, "checksum": index.checksum,
+                "payload": payload}
+    with tempfile.NamedTemporaryFile("w", dir=cache_dir, suffix=".json",
+                                     delete=False) as handle:
+        json.dump(metadata, handle)
+    os.replace(handle.name, metadata_file)
+
+
+def _read_arm_index(genome: str, checksum: str,
+                    cache_dir: Path) -> ArmIndex | None:
+
+    data_file, metadata_file = _index_paths(genome, checksum, cache_dir)
+    try:
+        metadata = json.loads(metadata_file.read_text())
+        payload = hashlib.sha256(data_file.read_bytes()).hexdigest()
+    except (OSError, ValueError):
+        return None
+
+    if (metadata.get("version") != ARM_INDEX_VERSION
+            or metadata.get("checksum") != checksum
+            or metadata.get("payload") != payload):
+        return None
+
+    arms = np.load(data_file, mmap_mode="r", allow_pickle=False)
+
+    return ArmIndex(genome, tuple(metadata["contigs"]), arms, checksum)
+
+
+def _registry_path(cache_dir: Path) -> Path:
+    return cache_dir / "registry.json"
+
+
+def _cached_arm_index(genome: str, bands: list[tuple[str, str, int, int]],
+                      cache_dir: Path) -> ArmIndex:
+
+    checksum = _bands_checksum(bands)
+    index = _read_arm_index(genome, checksum, cache_dir)
+    if index is not None:
+        return index
+
+    index = compile_arm_index(genome, bands)
+    try:
+        _write_arm_index(index, cache_dir)
+    except OSError:
+        # Read-only cache location: use the in-memory arrays
+        return index
+
+    return _read_arm_index(genome, checksum, cache_dir) or index
+
+
+def register_genome(genome: str, cytoband: str | Path,
+                    cache_dir: str | Path | None = None) -> ArmIndex:
+    """Compile a local cytoBand file and record it under a genome name."""
+
+    cache_dir = Path(cache_dir or default_cache_dir())
+    index = _cached_arm_index(genome, read_cytoband(cytoband), cache_dir)
+
+    registry_file = _registry_path(cache_dir)
+    try:
+        registry = json.loads(registry_file.read_text())
+    except (OSError, ValueError):
+        registry = {}
+    registry[genome] = {"cytoband": str(Path(cytoband).resolve()),
+                        "checksum": index.checksum}
+    try:
+        with tempfile.NamedTemporaryFile("w", dir=cache_dir, suffix=".json",
+                                         delete=False) as handle:
+            json.dump(registry, handle, indent=2)
+        os.replace(handle.name, registry_file)
+    except OSError:
+        pass
 
-    table = table.assign(ArmLength=table.apply(lambda x: x.End - x.Start, axis=1))
+    return index
+
+
+def load_arm_index(genome: str = "hg38", cytoband: str | Path | None = None,
+                   cache_dir: str | Path | None = None) -> ArmIndex:
+    """Return the compiled arm index for a genome, building it if needed.
+
+    Built-in assemblies need no network access. Other assemblies are read
+    from ``cytoband`` (and registered under ``genome`` for later runs) or
+    from a previous registration. The compiled arrays are memory-mapped from
+    the cache, and are rebuilt whenever the source checksum changes.
+    """
+
+    cache_dir = Path(cache_dir or default_cache_dir())
+
+    if cytoband is not None:
+        if genome in BUILTIN_GENOMES:
+            return _cached_arm_index(genome, read_cytoband(cytoband),
+                                     cache_dir)
+        return register_genome(genome, cytoband, cache_dir)
+
+    if genome in BUILTIN_GENOMES:
+        return _cached_arm_index(genome, _builtin_bands(genome), cache_dir)
+
+    try:
+        entry = json.loads(_registry_path(cache_dir).read_text())[genome]
+    except (OSError, ValueError, KeyError):
+        raise ValueError(
+            f"Unknown genome {genome}: supply a cytoband file or "
+            "register it first") from None
+
+    source = Path(entry["cytoband"])
+    if source.exists():
+        return _cached_arm_index(genome, read_cytoband(source), cache_dir)
+
+    # The source is gone: trust the cached copy only if it is intact
+    index = _read_arm_index(genome, entry["checksum"], cache_dir)
+    if index is None:
+        raise ValueError(f"Cached index for {genome} is missing or corrupt "
+                         f"and {source} is unavailable")
+
+    return index
+
+
+def arm_table(index: ArmIndex) -> pd.DataFrame:
+
+    arms = index.arms
+    table = pd.DataFrame({
+        "Chromosome": np.asarray(index.contigs, dtype=object)[arms["contig"]],
+        "Name": np.asarray(ARM_NAMES, dtype=object)[arms["arm"]],
+        "Start": arms["start"].astype("int64"),
+        "End": arms["end"].astype("int64"),
+    })
+    table["ArmLength"] = table["End"] - table["Start"]
 
     return table
 
 
-def ucsc_to_ncbi(dataframe: pd.DataFrame) -> pd.DataFrame:
+def get_chromosomal_arm_lengths(genome: str = "hg38",
+                                cytoband: str | Path | None = None,
+                                cache_dir: str | Path | None = None
+                                ) -> pd.DataFrame:
 
-    result = dataframe.transform_column("chromosome",
-                                        lambda x: x.str.replace, "chr", "",
-                                        elementwise=False)
+    return arm_table(load_arm_index(genome, cytoband, cache_dir))
 
-    return result
 
-def ncbi_to_ucsc(dataframe: pd.DataFrame) -> pd.DataFrame:
+# Names a chromosome may have besides its arm table name with and without
+# the "chr" prefix: numbered sex chromosomes and the UCSC and NCBI names of
+# the mitochondrial genome
+CONTIG_SYNONYMS = {"X": ("23",), "Y": ("24",), "M": ("MT",), "MT": ("M",)}
 
-    result = (
-        dataframe
-        .astype({"chromosome": "str"})
-        .transform_column("chromosome", lambda x: x.radd("chr"),
-                          elementwise=False)
-    )
 
-    return result
+# Unknown contigs are reported once per process, not once per sample
+_REPORTED_CONTIGS: set[str] = set()
+
+
+@functools.lru_cache(maxsize=None)
+def contig_aliases(contigs: tuple[str, ...]) -> dict[str, str]:
+    """Map every accepted name of the arm table ``contigs`` to the table's own.
+
+    The table only depends on the contigs of a genome, so it is built once
+    per genome. Alt, unplaced and other contigs absent from the arm table
+    have no alias.
+    """
+
+    aliases = dict(zip(contigs, contigs))
+    for contig in contigs:
+        bare = contig.removeprefix("chr")
+        for name in (bare, *CONTIG_SYNONYMS.get(bare, ())):
+            aliases.setdefault(name, contig)
+            aliases.setdefault("chr" + name, contig)
+
+    return aliases
 
 
-def classifier(row) -> Literal['S', 'U', 'HU'] | None:
-    cnb = row.cnb
+def canonicalize_contigs(chromosome: pd.Series,
+                         contigs: tuple[str, ...]) -> pd.Series:
+    """Recode chromosome names to the names of the arm table ``contigs``.
 
-    if pd.isnull(cnb): # No CNB calculated, we assume stable
-        return "S"
+    Only the distinct names are looked up, so the cost grows with the
+    number of contigs rather than of segments, and the result is
+    categorical. Names matching no contig are kept, and reported up front
+    since their segments get no normalized length.
+    """
 
-    length = row.normalized_length
-    if length > 0.95 and cnb < 2.5:
-        return "S"
-    if length > 0.95 and cnb > 2.5:
-        return "U"
-    if length < 0.95 and cnb > 27:
-        return "HU"
-    if length < 0.95 and cnb < 27:
-        return "U"
+    chromosome = (chromosome.astype("category")
+                  .cat.remove_unused_categories())
+    names = chromosome.cat.categories.astype("str")
+    aliases = contig_aliases(contigs)
+    canonical = [aliases.get(name) for name in names]
 
+    unknown = [name for name, contig in zip(names, canonical)
+               if contig is None]
+    unreported = set(unknown).difference(_REPORTED_CONTIGS)
+    if unreported:
+        _REPORTED_CONTIGS.update(unreported)
+        warnings.warn("Segments on contigs absent from the arm table get no "
+                      "normalized length: "
+                      f"{', '.join(sorted(unreported, key=_natural_key))}",
+                      stacklevel=2)
 
-def copy_number_burden(value) -> float:
-    cnb = value.sum() / 3e9
-    cnb = round(cnb * 100, 4)
+    present = set(canonical)
+    categories = pd.Index([*(contig for contig in contigs
+                             if contig in present), *unknown])
+    recode = categories.get_indexer([contig or name for contig, name
+                                     in zip(canonical, names)])
+    codes = chromosome.cat.codes.to_numpy()
+    codes = np.where(codes < 0, -1, recode[codes])
+
+    return pd.Series(pd.Categorical.from_codes(codes, categories),
+                     index=chromosome.index, name=chromosome.name)
+
+
+class Thresholds(NamedTuple):
+    """Cut-offs of the pattern classifier (Pesenti et al.)."""
+    length: float = 0.95
+    stable_cnb: float = 2.5
+    unstable_cnb: float = 27.0
+
+
+# Reason codes of the classification rules, in order of evaluation
+REASONS = {
+    "no_cnb": "S",               # No CNB calculated, we assume stable
+    "no_length": None,           # No segment could be placed on an arm
+    "long_low_cnb": "S",
+    "long_high_cnb": "U",
+    "short_very_high_cnb": "HU",
+    "short_high_cnb": "U",
+}
+
+
+def classify_patterns(summary: pd.DataFrame,
+                      thresholds: Thresholds = Thresholds()) -> pd.DataFrame:
+    """Assign S/U/HU patterns from normalized length and CNB, columnwise.
+
+    Values equal to a threshold fall on the upper side: a normalized length
+    of exactly ``thresholds.length`` counts as long, and a CNB of exactly
+    ``stable_cnb`` or ``unstable_cnb`` counts as above that cut-off.
+    """
+
+    cnb = summary["cnb"].to_numpy("float64")
+    length = summary["normalized_length"].to_numpy("float64")
+    long_segments = length >= thresholds.length
+
+    conditions = [
+        np.isnan(cnb),
+        np.isnan(length),
+        long_segments & (cnb < thresholds.stable_cnb),
+        long_segments,
+        cnb >= thresholds.unstable_cnb,
+        np.ones_like(long_segments),
+    ]
+    reasons = np.select(conditions, list(REASONS), default="no_length")
+    patterns = pd.Series(reasons, index=summary.index).map(REASONS)
+
+    return summary.assign(pattern=patterns, reason=reasons)
+
+
+def copy_number_burden(length):
+    """Altered length as a percentage of a 3 Gb genome."""
+    cnb = length / 3e9
+    cnb = np.round(cnb * 100, 4)
     return cnb
 
 
-def adjust_call(value: int, ploidy: int) -> float:
+def adjust_call(value: pd.DataFrame, ploidy) -> np.ndarray:
+    """Copy number relative to ploidy, as a (segments, ploidies) array.
 
-    cn = value["absolute_cn"]
-    adjusted = cn - ploidy
+    ``ploidy`` is a single ploidy, a row of ploidies to evaluate every
+    segment at, or a column with the ploidy of each segment.
+    """
+
+    cn = value["absolute_cn"].to_numpy("float64")[:, None]
+    adjusted = cn - np.asarray(ploidy, dtype="float64")
     return adjusted
 
 
-def harmonize_columns(
-    dataframe: pd.DataFrame,
-        format: Literal['ascat', 'ichorcna', 'ace']) -> pd.DataFrame:
-
-    match format:
-        case "ascat":
-            dataframe = dataframe.rename(
-                columns={"total_copy_number": "absolute_cn"}
-            )
-        case "ace":
-            dataframe = dataframe.rename(
-                columns={"copies": "absolute_cn"}
-            )
-        case "ichorcna":
-            dataframe = dataframe.rename(
-                columns={"copy_number": "absolute_cn",
-                         "chrom": "chromosome"}
-            )
-        case _:
-            raise ValueError(f"Unsupported file format {format}")
+def copy_number_burdens(segments: pd.DataFrame, ploidy) -> pd.DataFrame:
+    """CNB of every sample (rows) at every ploidy (columns), in one pass.
+
+    Segments with a NaN copy number count as altered; samples without
+    altered segments get no CNB.
+    """
+
+    altered = adjust_call(segments, ploidy) != 0
+    length = segments["length"].to_numpy("float64")[:, None]
+    samples = segments["sample"]
+
+    burden = (pd.DataFrame(np.where(altered, length, 0), index=samples.index)
+              .groupby(samples, observed=True).sum())
+    any_altered = (pd.DataFrame(altered, index=samples.index)
+                   .groupby(samples, observed=True).any())
+
+    return copy_number_burden(burden).where(any_altered)
+
+
+class SegmentFormat(NamedTuple):
+    """How to read the segment files of one copy number caller.
+
+    ``columns`` maps the (cleaned) columns read from a file to the names
+    used by the classifier (chromosome, start, end and absolute_cn); columns
+    a file lacks are not read. ``signature`` are the columns that identify
+    the format in a header, ``dtypes`` the types text files are parsed
+    with, and ``transform`` optionally derives the classifier columns once
+    renamed.
+    """
+    name: str
+    columns: dict[str, str]
+    signature: tuple[str, ...]
+    dtypes: Mapping[str, str] = MappingProxyType({})
+    transform: Callable[[pd.DataFrame], pd.DataFrame] | None = None
+
+    def source(self, column: str) -> str | None:
+        """The file column that becomes ``column``, if any."""
+        return next((name for name, target in self.columns.items()
+                     if target == column), None)
+
+
+SEGMENT_FORMATS: dict[str, SegmentFormat] = {}
+
+_FORMAT_MODULES: list[str] = []
+
+
+def register_format(segment_format: SegmentFormat) -> SegmentFormat:
+    """Make a format available to --file-format and to format detection."""
+
+    SEGMENT_FORMATS[segment_format.name] = segment_format
+    return segment_format
+
+
+def load_format_module(module: str) -> None:
+    """Import a module (or .py file) that registers further formats."""
+
+    # Modules import this script by name to register with it, which must
+    # not load a second copy when it runs as __main__
+    sys.modules.setdefault("calculate_scnapattern", sys.modules[__name__])
+
+    if module.endswith(".py"):
+        spec = importlib.util.spec_from_file_location(Path(module).stem,
+                                                      module)
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+    else:
+        importlib.import_module(module)
+    _FORMAT_MODULES.append(module)
+
+
+def format_module_digests() -> dict[str, str | None]:
+    """Content digest of each loaded format module, by module name."""
+
+    digests = {}
+    for module in _FORMAT_MODULES:
+        if module.endswith(".py"):
+            source = module
+        else:
+            source = getattr(sys.modules.get(module), "__file__", None)
+        digests[module] = file_digest(source) if source else None
+
+    return digests
+
+
+def get_segment_format(name: str) -> SegmentFormat:
+
+    try:
+        return SEGMENT_FORMATS[name]
+    except KeyError:
+        raise ValueError(f"Unsupported file format {name}") from None
+
+
+def detect_format(columns: list[str]) -> str:
+    """Name of the registered format matching a header.
+
+    When several signatures match, the most specific one (with the most
+    columns) wins.
+    """
+
+    header = {_clean_name(name) for name in columns}
+    matches = [segment_format for segment_format in SEGMENT_FORMATS.values()
+               if header.issuperset(segment_format.signature)]
+    if not matches:
+        raise ValueError(f"No known segment format has the columns "
+                         f"{', '.join(columns)}")
+
+    most_specific = max(len(match.signature) for match in matches)
+    names = [match.name for match in matches
+             if len(match.signature) == most_specific]
+    if len(names) > 1:
+        raise ValueError(f"Ambiguous segment format, could be any of "
+                         f"{', '.join(names)}")
+
+    return names[0]
+
+
+def resolve_format(source: str | Path, file_format: str | None) -> str:
+    """``file_format``, or the format detected from the header of ``source``."""
+    return file_format or detect_format(read_column_names(source))
+
+
+def _one_based(segments: pd.DataFrame) -> pd.DataFrame:
+    # Closed 1-based intervals to the half-open 0-based ones used here
+    return segments.assign(start=segments["start"] - 1)
+
+
+def _log2_copy_number(segments: pd.DataFrame) -> pd.DataFrame:
+    # Nearest integer copy number of a diploid genome, unless the caller
+    # already provided one
+    if "absolute_cn" in segments.columns:
+        return segments
+    return segments.assign(absolute_cn=np.round(2 * np.exp2(segments["log2"])))
+
+
+register_format(SegmentFormat(
+    "ascat",
+    {"chromosome": "chromosome", "start": "start", "end": "end",
+     "total_copy_number": "absolute_cn"},
+    signature=("chromosome", "start", "end", "total_copy_number"),
+    dtypes={"chromosome": "category", "total_copy_number": "float64"}))
+
+register_format(SegmentFormat(
+    "ace",
+    {"chromosome": "chromosome", "start": "start", "end": "end",
+     "copies": "absolute_cn"},
+    signature=("chromosome", "start", "end", "copies"),
+    dtypes={"chromosome": "category", "copies": "float64"}))
+
+register_format(SegmentFormat(
+    "ichorcna",
+    {"chrom": "chromosome", "start": "start", "end": "end",
+     "copy_number": "absolute_cn"},
+    signature=("chrom", "start", "end", "copy_number"),
+    dtypes={"chrom": "category", "copy_number": "float64"}))
+
+# CNVkit .cns segments, with the integer copy numbers of "cnvkit.py call"
+# or else the log2 ratios
+register_format(SegmentFormat(
+    "cnvkit",
+    {"chromosome": "chromosome", "start": "start", "end": "end",
+     "cn": "absolute_cn", "log2": "log2"},
+    signature=("chromosome", "start", "end", "gene", "log2"),
+    dtypes={"chromosome": "category", "cn": "float64", "log2": "float64"},
+    transform=_log2_copy_number))
+
+# QDNAseq segments exported with exportBins(format = "seg")
+register_format(SegmentFormat(
+    "qdnaseq",
+    {"chromosome": "chromosome", "start": "start", "stop": "end",
+     "log2_ratio_mean": "log2"},
+    signature=("chromosome", "start", "stop", "log2_ratio_mean"),
+    dtypes={"chromosome": "category", "log2_ratio_mean": "float64"},
+    transform=lambda segments: _log2_copy_number(_one_based(segments))))
+
+# PURPLE somatic copy number (.purple.cnv.somatic.tsv)
+register_format(SegmentFormat(
+    "purple",
+    {"chromosome": "chromosome", "start": "start", "end": "end",
+     "copynumber": "absolute_cn"},
+    signature=("chromosome", "start", "end", "copynumber", "bafcount"),
+    dtypes={"chromosome": "category", "copynumber": "float64"},
+    transform=_one_based))
+
+
+def harmonize_columns(dataframe: pd.DataFrame,
+                      format: str) -> pd.DataFrame:
+
+    segment_format = get_segment_format(format)
+    dataframe = dataframe.rename(columns=segment_format.columns)
+    if segment_format.transform is not None:
+        dataframe = segment_format.transform(dataframe)
+
+    missing = {"chromosome", "start", "end", "absolute_cn"}.difference(
+        dataframe.columns)
+    if missing:
+        raise ValueError(f"Segments lack the {format} columns for: "
+                         f"{', '.join(sorted(missing))}")
 
     return dataframe
 
+
+# Columnar formats are recognized by extension, anything else is TSV
+TABLE_FORMATS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+    ".ipc": "feather",
+}
+
+
+def table_format(path: str | Path) -> Literal['tsv', 'parquet', 'feather']:
+    return TABLE_FORMATS.get(Path(path).suffix.lower(), "tsv")
+
+
+def read_column_names(source: str | Path) -> list[str]:
+    """Column names of a segment table, read from the header or schema only."""
+
+    match table_format(source):
+        case "parquet":
+            import pyarrow.parquet
+            return pyarrow.parquet.read_schema(source).names
+        case "feather":
+            import pyarrow.ipc
+            with pyarrow.ipc.open_file(source) as reader:
+                return reader.schema.names
+        case _:
+            return pd.read_table(source, nrows=0).columns.tolist()
+
+
+def segment_columns(source: str | Path, file_format: str,
+                    extra: tuple[str, ...] = ()) -> list[str] | None:
+    """Columns of ``source`` that harmonize_columns and the classifier use.
+
+    ``extra`` are further (cleaned) column names to keep. Returns the names
+    as they appear in the file, or None (all columns) for an unknown
+    format, which is left to harmonize_columns to reject.
+    """
+
+    if file_format not in SEGMENT_FORMATS:
+        return None
+    wanted = {"sample", *SEGMENT_FORMATS[file_format].columns, *extra}
+
+    return [name for name in read_column_names(source)
+            if _clean_name(name) in wanted]
+
+
+def compact_segments(segments: pd.DataFrame,
+                     file_format: str) -> pd.DataFrame:
+    """Categorical labels, 32-bit positions and narrow copy numbers.
+
+    Expects clean column names. Positions and copy numbers are only
+    narrowed when no value changes; anything else is left as it is.
+    """
+
+    if file_format not in SEGMENT_FORMATS:
+        return segments
+    segment_format = SEGMENT_FORMATS[file_format]
+    cn_column = segment_format.source("absolute_cn")
+
+    dtypes = {}
+    for column in segments.columns.intersection(
+            ["sample", segment_format.source("chromosome")]):
+        dtypes[column] = "category"
+
+    for column in segments.columns.intersection(
+            [segment_format.source("start"), segment_format.source("end")]):
+        values = segments[column]
+        if (pd.api.types.is_integer_dtype(values) and len(values)
+                and values.min() >= np.iinfo("int32").min
+                and values.max() <= np.iinfo("int32").max):
+            dtypes[column] = "int32"
+
+    if cn_column in segments.columns:
+        values = segments[cn_column]
+        if (pd.api.types.is_integer_dtype(values) and len(values)
+                and values.min() >= np.iinfo("int16").min
+                and values.max() <= np.iinfo("int16").max):
+            dtypes[cn_column] = "int16"
+        elif pd.api.types.is_float_dtype(values):
+            values = values.to_numpy()
+            if np.array_equal(values.astype("float32"), values,
+                              equal_nan=True):
+                dtypes[cn_column] = "float32"
+
+    return segments.astype(dtypes)
+
+
+def read_segments(source: str | Path, file_format: str,
+                  extra: tuple[str, ...] = ()) -> pd.DataFrame:
+    """Read a TSV, Parquet or Feather segment table with compact dtypes.
+
+    Only the columns the classification needs (plus ``extra``) are read,
+    and column names come back cleaned.
+    """
+
+    columns = segment_columns(source, file_format, extra)
+
+    match table_format(source):
+        case "parquet":
+            segments = pd.read_parquet(source, columns=columns)
+        case "feather":
+            segments = pd.read_feather(source, columns=columns)
+        case _:
+            dtypes = {"sample": "category"}
+            if file_format in SEGMENT_FORMATS:
+                dtypes.update(SEGMENT_FORMATS[file_format].dtypes)
+            segments = pd.read_table(
+                source, usecols=columns,
+                dtype={name: dtypes[_clean_name(name)]
+                       for name in columns or ()
+                       if _clean_name(name) in dtypes})
+
+    return compact_segments(segments.clean_names(), file_format)
+
+
+def iter_segment_chunks(source: str | Path, chunksize: int,
+                        columns: list[str] | None = None,
+                        dtype: dict | None = None):
+    """Yield a segment table ``chunksize`` rows at a time, in any format."""
+
+    match table_format(source):
+        case "parquet":
+            import pyarrow.parquet
+            batches = pyarrow.parquet.ParquetFile(source).iter_batches(
+                batch_size=chunksize, columns=columns)
+        case "feather":
+            import pyarrow.feather
+            batches = pyarrow.feather.read_table(
+                source, columns=columns, memory_map=True
+            ).to_batches(max_chunksize=chunksize)
+        case _:
+            yield from pd.read_table(source, chunksize=chunksize,
+                                     usecols=columns, dtype=dtype)
+            return
+
+    for batch in batches:
+        chunk = batch.to_pandas()
+        yield chunk.astype(dtype) if dtype else chunk
+
+
+def write_table(table: pd.DataFrame, destination: str | Path) -> None:
+    """Write a classification table as TSV, Parquet or Feather."""
+
+    match table_format(destination):
+        case "tsv":
+            table.to_csv(destination, sep="\t", index=True)
+            return
+        case "parquet":
+            write = pd.DataFrame.to_parquet
+        case "feather":
+            write = pd.DataFrame.to_feather
+
+    # Columnar outputs keep the sample as a column and the labels as
+    # dictionary-encoded categoricals
+    table = table.reset_index().astype({
+        column: "category" for column in ("pattern", "reason")
+        if column in table.columns})
+    write(table, destination)
+
+
+# Smallest number of segments worth splitting by chromosome across threads
+PARALLEL_MIN_ROWS = 500_000
+
+
+def _arm_axis(arm_data: pd.DataFrame
+              ) -> tuple[pd.Index, np.ndarray, np.ndarray, np.ndarray]:
+    """Arm table contigs, and the arm order, starts and ends on one axis.
+
+    The arms are sorted by chromosome and start, and all chromosomes placed
+    on a single axis (chromosome code in the upper 32 bits), so that a
+    single searchsorted call finds the arms of every segment without
+    crossing chromosomes.
+    """
+
+    contigs = pd.Index(arm_data["Chromosome"].unique())
+    arm_contig = contigs.get_indexer(arm_data["Chromosome"]).astype("int64")
+    order = np.lexsort((arm_data["Start"].to_numpy(), arm_contig))
+    arm_contig = arm_contig[order]
+    arm_start = (arm_contig << 32) + arm_data["Start"].to_numpy("int64")[order]
+    arm_end = (arm_contig << 32) + arm_data["End"].to_numpy("int64")[order]
+
+    return contigs, order, arm_start, arm_end
+
+
+def assign_arms(absolute_calls: pd.DataFrame, arm_data: pd.DataFrame,
+                workers: int = 1) -> tuple[pd.Categorical, np.ndarray]:
+    """Arm of each segment and the length it is normalized over.
+
+    Segments spanning the centromere get the "whole" arm and the
+    chromosome length; segments off the arm table get no arm and NaN.
+    With several ``workers``, large inputs are processed one chromosome
+    per thread.
+    """
+
+    if workers > 1 and len(absolute_calls) >= PARALLEL_MIN_ROWS:
+        return _assign_arms_by_chromosome(absolute_calls, arm_data, workers)
+
+    contigs, order, arm_start, arm_end = _arm_axis(arm_data)
+    arm_length = arm_data["ArmLength"].to_numpy("int64")[order]
+    arm_names = pd.Index(arm_data["Name"].to_numpy()[order])
+
+    arm_contig = arm_start >> 32
+    contig_offsets = np.flatnonzero(
+        np.r_[True, arm_contig[1:] != arm_contig[:-1]])
+    chromosome_length = (np.maximum.reduceat(arm_end, contig_offsets)
+                         - np.minimum.reduceat(arm_start, contig_offsets))
+
+    segment_contig = contigs.get_indexer(
+        absolute_calls["chromosome"]).astype("int64")
+    known = segment_contig >= 0
+    segment_start = (segment_contig << 32) + absolute_calls["start"].to_numpy("int64")
+    segment_end = (segment_contig << 32) + absolute_calls["end"].to_numpy("int64")
+
+    # First arm ending after the segment start, last arm starting before
+    # the segment end: more than one arm in between means that the segment
+    # spans the centromere
+    first = np.searchsorted(arm_end, segment_start, side="right")
+    last = np.searchsorted(arm_start, segment_end, side="left") - 1
+    overlaps = np.where(known, last - first + 1, 0)
+
+    single = overlaps == 1
+    spanning = overlaps > 1
+    matched_arm = np.clip(first, 0, len(arm_start) - 1)
+
+    # Arm codes index into the arm names, with "whole" appended for
+    # segments spanning the centromere: these are normalized over the
+    # total chromosome length
+    categories = arm_names.unique()
+    name_codes = categories.get_indexer(arm_names)
+    arm_code = np.select([single, spanning],
+                         [name_codes[matched_arm], len(categories)], -1)
+    length = np.select(
+        [single, spanning],
+        [arm_length[matched_arm],
+         chromosome_length[np.clip(segment_contig, 0, None)]],
+        0).astype("float64")
+    length[arm_code < 0] = np.nan
+
+    arm = pd.Categorical.from_codes(arm_code,
+                                    categories=[*categories, "whole"])
+    return arm, length
+
+
+def _assign_arms_by_chromosome(absolute_calls: pd.DataFrame,
+                               arm_data: pd.DataFrame, workers: int
+                               ) -> tuple[pd.Categorical, np.ndarray]:
+    """assign_arms on each chromosome in a thread pool.
+
+    Arm assignment is independent per chromosome and numpy releases the
+    GIL in the searches, so threads share the arm table without copies.
+    The partial results are put back in row order, so that the output
+    does not depend on the number of workers.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    calls = absolute_calls[["chromosome", "start", "end"]]
+    # One partition per distinct chromosome, including contigs absent from
+    # the arm table (which get no arm), plus one for missing chromosomes
+    # (code -1 from factorize, shifted to 0 and processed last)
+    codes, names = pd.factorize(calls["chromosome"])
+    codes = (codes + 1).astype("int16")
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(names) + 2))
+    partitions = sorted(
+        range(len(names) + 1),
+        key=lambda code: (code == 0,
+                          _natural_key(str(names[code - 1])) if code else []))
+
+    def assign(code):
+        rows = order[bounds[code]:bounds[code + 1]]
+        return rows, assign_arms(calls.iloc[rows], arm_data)
+
+    arm_code = np.empty(len(calls), dtype="int8")
+    length = np.empty(len(calls), dtype="float64")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for rows, (arm, partial_length) in executor.map(assign, partitions):
+            arm_code[rows] = arm.codes
+            length[rows] = partial_length
+
+    return pd.Categorical.from_codes(arm_code, dtype=arm.dtype), length
+
+
 def normalized_scna_length(absolute_calls: pd.DataFrame,
-                           arm_data: pd.DataFrame) -> pd.DataFrame:
-
-    # Convert the dataframes to PyRanges objects
-    calls_pr = pr.PyRanges(absolute_calls.rename(
-        columns={"chromosome": "Chromosome", "start": "Start", "end": "End"}))
-    arms_pr = pr.PyRanges(arm_data.rename(
-        columns={"chrom": "Chromosome", "chromStart": "Start",
-                 "chromEnd": "End", "arm": "Name"}))
-
-    # Perform intersection
-    intersected = calls_pr.join(arms_pr, how='left')
-
-    # A segment may overlap the centromere, causing duplicated regions
-    # with both p and q arms
-    # Cope with this by aggregating and using the total length as
-    # a "fake arm length"
-    intersected_df = intersected.df
-    # Generate a unique ID for each segment
-    intersected_df = intersected_df.join_apply(
-        lambda x: f"{x.Chromosome}:{x.Start}-{x.End}_{x['sample']}",
-        "SegmentID")
-    duplicated_segments = intersected_df[
-        intersected_df.duplicated('SegmentID', keep=False)]
-
-    # Calculate total chromosome lengths from arm_data
-    chromosome_lengths = arm_data.groupby('Chromosome').agg({
-        'Start': 'min', 'End': 'max'}).reset_index()
-    chromosome_lengths['ChromosomeLength'] = chromosome_lengths['End'].sub(
-        chromosome_lengths['Start'])
-
-    # Get rid of the dups
-    aggregated = duplicated_segments.drop_duplicates(
-        subset=["SegmentID"]).assign(
-            Name="whole").drop("ArmLength", axis=1).rename(
-                columns={"ChromosomeLength": "ArmLength"})
-    non_duplicated_segments = intersected_df.drop_duplicates(
-        subset='SegmentID', keep=False)
-    intersected_df = pd.concat([non_duplicated_segments, aggregated])
-
-    # Normalization: check if the segment spans both arms. If so,
-    # normalize over the total chromosome length.
-
-    intersected_df["normalized_length"] = intersected_df["length"].div(
-        intersected_df["ArmLength"])
-
-    # Clean up the DataFrame using pyjanitor to standardize column names
-    cleaned_df = (
-        intersected_df
-        .rename(columns={"Name": "arm", "ArmLength": "arm_length"})
-        .select_columns(['Chromosome', 'Start', 'End', 'sample', 'arm',
-                         'arm_length', 'normalized_length'])
-        .clean_names()
-    )
+                           arm_data: pd.DataFrame,
+                           workers: int = 1) -> pd.DataFrame:
 
-    return cleaned_df
+    arm, length = assign_arms(absolute_calls, arm_data, workers)
+    result = absolute_calls.assign(arm=arm, arm_length=length)
+    result["normalized_length"] = result["length"].div(result["arm_length"])
 
+    return result
 
-def call_patterns(segments: pd.DataFrame, arm_data: pd.DataFrame,
-                  ploidy: int):
 
-    segment_length = (
-        normalized_scna_length(segments, arm_data)
-        .merge(segments, on=["chromosome", "start", "end", "sample"],
-               how="inner")
-    )
+def compact_segment_runs(segments: pd.DataFrame, arm_data: pd.DataFrame,
+                         max_gap: int = 0) -> tuple[pd.DataFrame, np.ndarray]:
+    """Merge runs of adjacent segments with the same copy number.
+
+    Consecutive segments of a sample merge when they lie within the same
+    arm (so runs never cross the centromere, and segments spanning it or
+    off the arm table stay on their own), have the same copy number and
+    are at most ``max_gap`` bp apart. A merged segment keeps the summed
+    length of its members rather than its span, so the CNB does not
+    change; other columns keep the values of the first member.
+
+    Runs are found with one search of the segment starts against the arm
+    ends, rather than a full arm join. Returns the merged segments and, for
+    each row of ``segments``, the merged row it belongs to: a merged row
+    lies within the arm of its members, so assign_arms gives it theirs.
+    """
+
+    if len(segments) < 2:
+        return segments, np.arange(len(segments))
+
+    contigs, _, arm_start, arm_end = _arm_axis(arm_data)
+    contig = contigs.get_indexer(segments["chromosome"]).astype("int64")
+    start = segments["start"].to_numpy("int64")
+    end = segments["end"].to_numpy("int64")
+
+    # The arm holding each segment whole, or -1
+    position_start = (contig << 32) + start
+    position_end = (contig << 32) + end
+    arm = np.minimum(np.searchsorted(arm_end, position_start, side="right"),
+                     len(arm_end) - 1)
+    arm = np.where((contig >= 0) & (end > start)
+                   & (arm_start[arm] <= position_start)
+                   & (position_end <= arm_end[arm]), arm, -1)
+
+    # Segment files usually list each sample and chromosome in one block,
+    # by start, in which case the sort is skipped
+    sample = pd.factorize(segments["sample"])[0]
+    block = pd.factorize(segments["chromosome"])[0]
+    length = segments["length"].to_numpy("int64")
+    cn = segments["absolute_cn"].to_numpy("float64")
+    same_sample = sample[1:] == sample[:-1]
+    same_block = same_sample & (block[1:] == block[:-1])
+    if ((sample[1:] > sample[:-1])
+            | (same_sample & (block[1:] > block[:-1]))
+            | (same_block & (start[1:] >= start[:-1]))).all():
+        order = np.arange(len(segments))
+    else:
+        order = np.lexsort((start, block, sample))
+        start, end, length, cn, arm, sample = (
+            values[order] for values in (start, end, length, cn, arm, sample))
+
+    gap = start[1:] - end[:-1]
+    same_cn = (cn[1:] == cn[:-1]) | (np.isnan(cn[1:]) & np.isnan(cn[:-1]))
+    joins = ((sample[1:] == sample[:-1]) & (arm[1:] == arm[:-1])
+             & (arm[1:] >= 0) & same_cn & (gap >= 0) & (gap <= max_gap))
+    run_starts = np.flatnonzero(np.r_[True, ~joins])
+
+    run = np.empty(len(segments), dtype="int64")
+    run[order] = np.cumsum(np.r_[True, ~joins]) - 1
+
+    compacted = (segments.iloc[order[run_starts]]
+                 .assign(end=np.maximum.reduceat(end, run_starts),
+                         length=np.add.reduceat(length, run_starts))
+                 .reset_index(drop=True))
+    return compacted, run
+
+
+def segment_metrics(segment_length: pd.DataFrame,
+                    ploidy: int | list[int] | str = 2) -> pd.DataFrame:
+    """Burden metrics of each sample, genome-wide and per arm, in one pass.
+
+    ``segment_length`` is the output of normalized_scna_length. Per-segment
+    contributions are summed in a single groupby over sample, chromosome
+    and arm, and the genome-wide rows are summed from those. Regions are
+    arms (such as chr1p), chromosomes for segments spanning the
+    centromere, chromosomes suffixed with ":unassigned" for segments
+    without an arm (such as chr1:unassigned), or "genome". For each:
+
+    - segments and length: number and total length of the segments
+    - cnb: contribution to the CNB, with segments without a copy number
+      counted as altered, as for the CNB
+    - gain_cnb and loss_cnb: the same for segments above or below ploidy
+    - fga: fraction of the length with a copy number that is altered
+    - mean_cn: length-weighted mean copy number
+    """
+
+    if isinstance(ploidy, list):
+        metrics = pd.concat([
+            segment_metrics(segment_length, value).assign(ploidy=value)
+            for value in ploidy
+        ]).sort_index(level="sample", sort_remaining=False, kind="stable")
+        return metrics[["ploidy", *metrics.columns[:-1]]]
+
+    cn = segment_length["absolute_cn"].to_numpy("float64")
+    if isinstance(ploidy, str):
+        ploidy = segment_length[ploidy].to_numpy("float64")
+    length = segment_length["length"].to_numpy("float64")
+    called = ~np.isnan(cn)
+
+    contributions = pd.DataFrame({
+        "segments": 1,
+        "length": length,
+        "altered_length": np.where(cn != ploidy, length, 0),
+        "gain_length": np.where(cn > ploidy, length, 0),
+        "loss_length": np.where(cn < ploidy, length, 0),
+        "called_length": np.where(called, length, 0),
+        "cn_length": np.where(called, cn * length, 0),
+    }, index=segment_length.index)
+    keys = [segment_length["sample"],
+            segment_length["chromosome"].astype("category"),
+            segment_length["arm"]]
+
+    per_arm = contributions.groupby(keys, observed=True, dropna=False).sum()
+    samples, chromosomes, arms = (per_arm.index.get_level_values(level)
+                                  for level in range(3))
+    region = (chromosomes.astype("str")
+              + np.select([arms.isin(ARM_NAMES), arms.isna()],
+                          [arms.astype("str"), ":unassigned"], ""))
+    # Chromosome categories follow the arm table and arm categories its
+    # arm names, so their codes give the output order; segments without an
+    # arm come after the arms of their chromosome
+    arm_code = np.where(arms.codes < 0, len(arms.categories), arms.codes)
+    order = np.lexsort((arm_code, chromosomes.codes))
+    per_arm = (per_arm.set_axis(pd.MultiIndex.from_arrays(
+                   [samples, region], names=["sample", "region"]))
+               .iloc[order])
+
+    genome = per_arm.groupby(level="sample", sort=False).sum()
+    genome.index = pd.MultiIndex.from_arrays(
+        [genome.index, np.full(len(genome), "genome")],
+        names=["sample", "region"])
+    totals = pd.concat([genome, per_arm]).sort_index(level="sample",
+                                                     sort_remaining=False,
+                                                     kind="stable")
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return pd.DataFrame({
+            "segments": totals["segments"],
+            "length": totals["length"].astype("int64"),
+            "cnb": copy_number_burden(totals["altered_length"]),
+            "gain_cnb": copy_number_burden(totals["gain_length"]),
+            "loss_cnb": copy_number_burden(totals["loss_length"]),
+            "fga": (totals["gain_length"] + totals["loss_length"])
+                   / totals["called_length"],
+            "mean_cn": totals["cn_length"] / totals["called_length"],
+        })
+
+
+class MetricsTable:
+    """TSV file that the metrics of each sample are appended to.
+
+    Appends hold an exclusive lock on the file, so that batch workers can
+    share it.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.unlink(missing_ok=True)
+
+    def append(self, metrics: pd.DataFrame) -> None:
+        import fcntl
+
+        with open(self.path, "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                handle.seek(0, os.SEEK_END)
+                metrics.to_csv(handle, sep="\t", header=handle.tell() == 0)
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class Bootstrap(NamedTuple):
+    """Settings of the segment-level bootstrap of the pattern calls."""
+    replicates: int = 1000
+    seed: int = 0
+    confidence: float = 0.95
+
+
+BOOTSTRAP_BLOCK_CELLS = 2**22
+
+
+def _sample_seed(seed: int | list[int], sample) -> np.random.SeedSequence:
+    # Seeded by sample name, so that results do not depend on the order or
+    # the grouping (process, batch) in which samples are resampled
+    digest = hashlib.sha256(str(sample).encode()).digest()
+    seed = seed if isinstance(seed, list) else [seed]
+    return np.random.SeedSequence([*seed,
+                                   int.from_bytes(digest[:8], "little")])
+
+
+def _row_quantile(values: np.ndarray, q: float) -> np.ndarray:
+    """Linear quantile of each row ignoring NaN.
+
+    The formula is that of pandas' groupby().quantile(), which gives the
+    point estimate in sample_summary, so that replicates of an unchanged
+    sample reproduce it to the last bit (Series.quantile and
+    np.nanquantile interpolate from the upper value past the midpoint,
+    which can differ in the last bit). Much faster than np.nanquantile
+    along an axis, which loops over rows.
+    """
+
+    ordered = np.sort(values, axis=1)  # NaN sort last
+    valid = np.count_nonzero(~np.isnan(values), axis=1)
+    position = np.maximum(valid - 1, 0) * q
+    lower = np.floor(position).astype("int64")
+    upper = np.minimum(lower + 1, np.maximum(valid - 1, 0))
+    fraction = position - lower
+
+    rows = np.arange(len(values))
+    low = ordered[rows, lower]
+    difference = ordered[rows, upper] - low
+    result = low + difference * fraction
+    result[valid == 0] = np.nan
+    return result
 
-    segment_length = (
-        segment_length
-        .assign(call=segment_length.apply(adjust_call, ploidy=ploidy, axis=1))
-    )
+
+def bootstrap_sample(normalized_length: np.ndarray,
+                     altered_length: np.ndarray, altered: np.ndarray,
+                     replicates: int, rng: np.random.Generator
+                     ) -> tuple[np.ndarray, np.ndarray]:
+    """Normalized length quantile and CNB of bootstrap replicates of a sample.
+
+    Each replicate resamples the segments with replacement. Replicates are
+    drawn as blocks of index arrays, bounded to BOOTSTRAP_BLOCK_CELLS.
+    """
+
+    count = len(normalized_length)
+    block = max(1, BOOTSTRAP_BLOCK_CELLS // max(1, count))
+    lengths = []
+    burdens = []
+    for start in range(0, replicates, block):
+        draws = rng.integers(0, count, size=(min(block, replicates - start),
+                                             count))
+        lengths.append(_row_quantile(normalized_length[draws], 0.75))
+        burdens.append(np.where(altered[draws].any(axis=1),
+                                copy_number_burden(
+                                    altered_length[draws].sum(axis=1)),
+                                np.nan))
+
+    return np.concatenate(lengths), np.concatenate(burdens)
+
+
+def bootstrap_intervals(segments: pd.DataFrame, ploidy: int,
+                        settings: Bootstrap = Bootstrap(),
+                        thresholds: Thresholds = Thresholds()
+                        ) -> pd.DataFrame:
+    """Bootstrap confidence intervals and pattern probabilities per sample.
+
+    ``segments`` are the output of normalized_scna_length. Returns, per
+    sample, the interval bounds of the normalized length quantile and the
+    CNB, and the share of replicates classified as each pattern.
+    """
+
+    altered = adjust_call(segments, ploidy)[:, 0] != 0
+    length = segments["length"].to_numpy("float64")
+    normalized_length = segments["normalized_length"].to_numpy("float64")
+    altered_length = np.where(altered, length, 0)
+    grid = pd.DataFrame([thresholds._asdict()])
+    tail = (1 - settings.confidence) / 2
+    names = [pattern or "NA" for pattern in PATTERNS]
+
+    rows = {}
+    for sample, positions in segments.groupby(
+            "sample", observed=True).indices.items():
+        rng = np.random.default_rng(_sample_seed(settings.seed, sample))
+        lengths, burdens = bootstrap_sample(
+            normalized_length[positions], altered_length[positions],
+            altered[positions], settings.replicates, rng)
+        codes = pattern_codes(pd.DataFrame({"normalized_length": lengths,
+                                            "cnb": burdens}), grid)[:, 0]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            length_bounds = np.nanquantile(lengths, [tail, 1 - tail])
+            cnb_bounds = np.round(
+                np.nanquantile(burdens, [tail, 1 - tail]), 4)
+        shares = np.bincount(codes, minlength=len(PATTERNS)) / len(codes)
+        rows[sample] = [*length_bounds, *cnb_bounds, *shares]
+
+    intervals = pd.DataFrame.from_dict(
+        rows, orient="index",
+        columns=["normalized_length_low", "normalized_length_high",
+                 "cnb_low", "cnb_high", *(f"p_{name}" for name in names)])
+    intervals.index.name = "sample"
+
+    return intervals
+
+
+def summary_table(normalized_length: pd.DataFrame, cnb: pd.DataFrame,
+                  ploidy: int | list[int] | str,
+                  sample_ploidy: pd.Series | None = None) -> pd.DataFrame:
+    """The per-sample table that classify_patterns takes.
+
+    ``cnb`` has one column per ploidy (see copy_number_burdens). Lists of
+    ploidies and ploidy columns (whose value for each sample is
+    ``sample_ploidy``) add a ploidy column, in front.
+    """
+
+    if isinstance(ploidy, str):
+        merged_table = normalized_length.assign(ploidy=sample_ploidy,
+                                                cnb=cnb[0])
+    elif isinstance(ploidy, (list, tuple)):
+        merged_table = pd.concat([
+            normalized_length.assign(ploidy=value, cnb=cnb[i])
+            for i, value in enumerate(ploidy)
+        ]).sort_index(kind="stable")
+    else:
+        merged_table = normalized_length.assign(cnb=cnb[0])
+
+    if "ploidy" in merged_table:
+        merged_table = merged_table[["ploidy", "normalized_length", "cnb"]]
+
+    return merged_table
+
+
+def sample_summary(segment_length: pd.DataFrame,
+                   ploidy: int | list[int] | str = 2) -> pd.DataFrame:
+    """Normalized length quantile and CNB of each sample (see summary_table).
+
+    ``segment_length`` is the output of normalized_scna_length.
+    """
 
     normalized_length = (
         segment_length
-        .groupby("sample")["normalized_length"]
+        .groupby("sample", observed=True)["normalized_length"]
         .quantile(0.75).to_frame()
     )
 
-    cnb = (
-        segment_length
-        .query("call != 0")
-        .groupby("sample")
-        .agg({"length": copy_number_burden})
-        .rename(columns={"length": "cnb"})
-    )
-
-    merged_table = pd.concat([normalized_length, cnb], axis=1)
-
-    merged_table = merged_table.assign(
-        pattern=merged_table.apply(classifier, axis=1)
-    )
+    if isinstance(ploidy, str):
+        sample_ploidy = (segment_length.groupby("sample", observed=True)
+                         [ploidy].agg(["first", "nunique"]))
+        ambiguous = sample_ploidy.index[sample_ploidy["nunique"] > 1]
+        if len(ambiguous):
+            raise ValueError(f"Samples with more than one {ploidy}: "
+                             f"{', '.join(map(str, ambiguous))}")
+        cnb = copy_number_burdens(
+            segment_length, segment_length[ploidy].to_numpy()[:, None])
+        return summary_table(normalized_length, cnb, ploidy,
+                             sample_ploidy["first"])
 
-    return merged_table
+    if isinstance(ploidy, (list, tuple)):
+        cnb = copy_number_burdens(segment_length, [ploidy])
+    else:
+        cnb = copy_number_burdens(segment_length, ploidy)
 
+    return summary_table(normalized_length, cnb, ploidy)
 
-def main():
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--ploidy", type=int, help="Ploidy of the sample",
-                        default=2)
-    parser.add_argument("--genome", choices=("hg19", "hg38"), default="hg38")
-    parser.add_argument("--file-format", choices=("ascat", "ichorcna",
-                                                  "ace"))
-    parser.add_argument("--genome-style", choices=("ucsc", "ncbi"),
-                        default="ucsc")
-    parser.add_argument("--sample-name", default="Sample")
-    parser.add_argument("source", help="Source segment file")
-    parser.add_argument("destination", help="Destination to save to")
-    parser.add_argument('--version', action='version',
-                        version='%(prog)s ' + __version__)
+def call_patterns(segments: pd.DataFrame, arm_data: pd.DataFrame,
+                  ploidy: int | list[int] | str,
+                  thresholds: Thresholds = Thresholds(),
+                  bootstrap: Bootstrap | None = None,
+                  compact_gap: int | None = None,
+                  chromosome_workers: int = 1,
+                  metrics: MetricsTable | None = None):
+    """Classify each sample of ``segments``.
+
+    ``ploidy`` is either one ploidy for every sample, a list of ploidies
+    to evaluate each sample at, or the name of a column giving the ploidy
+    of each sample. The last two add a ploidy column to the output, with
+    one row per sample and ploidy. The arm assignment and normalized
+    lengths do not depend on ploidy and are computed once.
+
+    With ``bootstrap`` (single ploidy only), bootstrap confidence intervals
+    and pattern probabilities are added to each sample.
+
+    With ``compact_gap``, runs of same-call segments at most that many bp
+    apart are merged first (see compact_segment_runs), so that only the
+    merged segments are joined to the arms. Results do not change: the
+    arms found are expanded back to the original segments. Large inputs are
+    joined to the arms with ``chromosome_workers`` threads. With
+    ``metrics``, the segment_metrics of each sample are appended to it.
+    """
+
+    if bootstrap is not None and not isinstance(ploidy, int):
+        raise ValueError("Bootstrap intervals need a single ploidy")
+
+    members = None
+    if compact_gap is not None:
+        with PROFILER.stage("compaction") as stage:
+            stage.rows = len(segments)
+            members = segments
+            segments, run = compact_segment_runs(segments, arm_data,
+                                                 compact_gap)
+            stage.output_rows = len(segments)
+
+    with PROFILER.stage("interval_join") as stage:
+        segment_length = normalized_scna_length(segments, arm_data,
+                                                chromosome_workers)
+        stage.rows = len(segment_length)
+        if members is not None:
+            # Members share the arm of their merged row: the rest of the
+            # classification sees the original segments, as without runs
+            arm = segment_length["arm"].array
+            segment_length = members.assign(
+                arm=pd.Categorical.from_codes(arm.codes[run],
+                                              dtype=arm.dtype),
+                arm_length=segment_length["arm_length"].to_numpy()[run])
+            segment_length["normalized_length"] = (
+                segment_length["length"].div(segment_length["arm_length"]))
+
+    with PROFILER.stage("aggregation") as stage:
+        merged_table = sample_summary(segment_length, ploidy)
+
+        if metrics is not None:
+            metrics.append(segment_metrics(segment_length, ploidy))
+        stage.rows = len(segment_length)
+
+    with PROFILER.stage("classification") as stage:
+        classified = classify_patterns(merged_table, thresholds)
+        stage.rows = len(classified)
+
+    if bootstrap is not None:
+        with PROFILER.stage("bootstrap") as stage:
+            classified = classified.join(bootstrap_intervals(
+                segment_length, ploidy, bootstrap, thresholds))
+            stage.rows = len(classified) * bootstrap.replicates
+
+    return classified
+
+
+def prepare_segments(segments: pd.DataFrame, file_format: str,
+                     contigs: tuple[str, ...]) -> pd.DataFrame:
+    """Harmonize the columns of ``segments`` and name their chromosomes.
+
+    Chromosomes get the names of the arm table ``contigs`` whatever their
+    style (see canonicalize_contigs).
+    """
+
+    with PROFILER.stage("chromosome_style") as stage:
+        segments = harmonize_columns(segments, file_format)
+        chromosome = canonicalize_contigs(segments["chromosome"], contigs)
+        segments = segments.assign(chromosome=chromosome,
+                                   length=segments.end.sub(segments.start))
+        stage.rows = len(segments)
+
+    return segments
+
+
+def arm_contigs(arm_data: pd.DataFrame) -> tuple[str, ...]:
+    return tuple(arm_data["Chromosome"].unique())
+
+
+def classify_segments(segments: pd.DataFrame, arm_data: pd.DataFrame,
+                      file_format: str | None,
+                      ploidy: int | list[int] | str = 2,
+                      sample_name: str | None = None,
+                      thresholds: Thresholds = Thresholds(),
+                      bootstrap: Bootstrap | None = None,
+                      matrix: BinnedMatrix | None = None,
+                      compact_gap: int | None = None,
+                      chromosome_workers: int = 1,
+                      metrics: MetricsTable | None = None) -> pd.DataFrame:
+
+    with PROFILER.stage("input_parsing"):
+        segments = segments.clean_names()
+
+    if sample_name:
+        segments["sample"] = sample_name
+
+    if not file_format:
+        file_format = detect_format(segments.columns.tolist())
+    segments = prepare_segments(segments, file_format, arm_contigs(arm_data))
+
+    if matrix is not None:
+        matrix.add_segments(segments, ploidy)
+
+    return call_patterns(segments, arm_data, ploidy, thresholds, bootstrap,
+                         compact_gap, chromosome_workers, metrics)
+
+
+def classify_segment_file(source: str | Path, arm_data: pd.DataFrame,
+                          file_format: str | None,
+                          ploidy: int | list[int] | str = 2,
+                          sample_name: str | None = None,
+                          thresholds: Thresholds = Thresholds(),
+                          cache: ResultCache | None = None,
+                          bootstrap: Bootstrap | None = None,
+                          matrix: BinnedMatrix | None = None,
+                          compact_gap: int | None = None,
+                          chromosome_workers: int = 1,
+                          metrics: MetricsTable | None = None
+                          ) -> pd.DataFrame:
+
+    file_format = resolve_format(source, file_format)
 
-    options = parser.parse_args()
+    # Fall back to integrated sample, except for ACE that doesn't have it
+    if not sample_name and file_format == "ace":
+        sample_name = Path(source).stem
+
+    # Only single-ploidy results, with the usual columns, are cached, and
+    # filling the binned matrix or the metrics needs the segments anyway
+    if (not isinstance(ploidy, int) or bootstrap is not None
+            or matrix is not None or metrics is not None):
+        cache = None
+
+    if cache is not None:
+        key = cache.key(source, file_format, ploidy, thresholds,
+                        sample_name, compact_gap)
+        rows = cache.get(key, sample_name)
+        if rows is not None:
+            return rows_to_table(rows)
+
+    with PROFILER.stage("input_parsing") as stage:
+        segments = read_segments(
+            source, file_format,
+            extra=(ploidy,) if isinstance(ploidy, str) else ())
+        stage.rows = len(segments)
+
+    table = classify_segments(segments, arm_data, file_format,
+                              ploidy=ploidy, sample_name=sample_name, thresholds=thresholds,
+                              bootstrap=bootstrap, matrix=matrix,
+                              compact_gap=compact_gap,
+                              chromosome_workers=chromosome_workers,
+                              metrics=metrics)
+
+    if cache is not None:
+        cache.put(key, [(str(sample), *values) for sample, *values
+                        in table.itertuples(name=None)])
 
-    source = pd.read_table(options.source).clean_names()
+    return table
 
-    if options.sample_name:
-        source["sample"] = options.sample_name
-    # Fall back to integrated sample, except for ACE that doesn't have it
-    elif options.file_format == "ace":
-        source["sample"] = Path(options.source).stem
 
-    source = harmonize_columns(source, options.file_format).astype(
-        {"chromosome": "str"}
-    )
+def _sample_runs(samples: pd.Series):
+    """Yield (sample, start, stop) for each run of identical consecutive values."""
+
+    values = samples.to_numpy()
+    breaks = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.r_[0, breaks]
+    stops = np.r_[breaks, len(values)]
+    for start, stop in zip(starts, stops):
+        yield values[start], start, stop
+
+
+def _is_grouped(source: str | Path, column: str, chunksize: int) -> bool:
+    """Check, reading only one column, whether each sample is contiguous."""
+
+    seen = set()
+    previous = None
+    for chunk in iter_segment_chunks(source, chunksize, columns=[column],
+                                     dtype={column: "str"}):
+        for sample, _, _ in _sample_runs(chunk[column]):
+            if sample == previous:
+                continue
+            if sample in seen:
+                return False
+            seen.add(sample)
+            previous = sample
+
+    return True
+
+
+def iter_sample_groups(source: str | Path, sample_column: str = "sample",
+                       chunksize: int = 1_000_000,
+                       file_format: str | None = None,
+                       extra: tuple[str, ...] = ()):
+    """Yield (sample, segments) from a multi-sample file, one sample at a time.
+
+    The file is read in chunks. If samples are contiguous, each is yielded
+    as soon as it is complete; otherwise chunks are first spilled to one
+    temporary file per sample. Either way only one sample is held in memory.
+    With ``file_format``, only the columns that format needs (plus
+    ``extra``) are read.
+    """
+
+    raw_names = {_clean_name(name): name for name in read_column_names(source)}
+    if sample_column not in raw_names:
+        raise ValueError(f"No {sample_column} column in {source}")
+    raw_column = raw_names[sample_column]
+
+    columns = segment_columns(source, file_format, extra)
+    if columns is not None and raw_column not in columns:
+        columns.append(raw_column)
+
+    def chunks():
+        reader = iter_segment_chunks(source, chunksize, columns=columns,
+                                     dtype={raw_column: "str"})
+        while True:
+            with PROFILER.stage("input_parsing") as stage:
+                chunk = next(reader, None)
+                if chunk is not None:
+                    chunk = chunk.clean_names()
+                    stage.rows = len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+    if _is_grouped(source, raw_column, chunksize):
+        pending = []
+        current = None
+        for chunk in chunks():
+            for sample, start, stop in _sample_runs(chunk[sample_column]):
+                if sample != current and pending:
+                    yield current, pd.concat(pending, ignore_index=True)
+                    pending = []
+                current = sample
+                pending.append(chunk.iloc[start:stop])
+        if pending:
+            yield current, pd.concat(pending, ignore_index=True)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="scnapattern_") as spill_dir:
+        spill_files = {}
+        for chunk in chunks():
+            for sample, group in chunk.groupby(sample_column, sort=False):
+                if sample not in spill_files:
+                    spill_files[sample] = Path(spill_dir) / f"{len(spill_files)}.tsv"
+                    group.to_csv(spill_files[sample], sep="\t", index=False)
+                else:
+                    group.to_csv(spill_files[sample], sep="\t", index=False,
+                                 mode="a", header=False)
+        for sample, spill_file in spill_files.items():
+            yield sample, pd.read_table(spill_file,
+                                        dtype={sample_column: "str"})
+            spill_file.unlink()
+
+
+def classify_multi_sample_file(source: str | Path, destination: str | Path,
+                               arm_data: pd.DataFrame,
+                               file_format: str | None,
+                               ploidy: int | list[int] | str = 2,
+                               thresholds: Thresholds = Thresholds(),
+                               sample_column: str = "sample",
+                               chunksize: int = 1_000_000,
+                               bootstrap: Bootstrap | None = None,
+                               matrix: BinnedMatrix | None = None,
+                               compact_gap: int | None = None,
+                               chromosome_workers: int = 1,
+                               metrics: MetricsTable | None = None) -> int:
+    """Classify every sample of a pooled segment file, writing as it goes.
+
+    Columnar destinations hold one row per sample and are written once at
+    the end. Returns the number of samples written.
+    """
+
+    file_format = resolve_format(source, file_format)
+    streaming = table_format(destination) == "tsv"
+    tables = []
+    written = 0
+    extra = (ploidy,) if isinstance(ploidy, str) else ()
+    contigs = arm_contigs(arm_data)
+    for sample, segments in iter_sample_groups(source, sample_column,
+                                               chunksize, file_format, extra):
+        segments = compact_segments(segments.assign(sample=sample),
+                                    file_format)
+        segments = prepare_segments(segments, file_format, contigs)
+        if matrix is not None:
+            matrix.add_segments(segments, ploidy)
+        table = call_patterns(segments, arm_data, ploidy, thresholds,
+                              bootstrap, compact_gap, chromosome_workers,
+                              metrics)
+        if streaming:
+            table.to_csv(destination, sep="\t", index=True,
+                         mode="a" if written else "w", header=not written)
+        else:
+            tables.append(table)
+        written += 1
+
+    if tables:
+        write_table(pd.concat(tables), destination)
+
+    return written
+
+
+# Streaming classification: one pass over the segments, in any order,
+# keeping only per-sample accumulators. The accumulators of separate passes
+# (over shards of a cohort, or in separate processes) can be merged.
+
+SKETCH_VERSION = 2
+
+# Partial results given as sources are recognized by this suffix
+SKETCH_SUFFIX = ".sketch.json"
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch of a stream of values (KLL).
+
+    Values are kept in levels of compactors of growing weight: a level
+    over its capacity is sorted and every other value, from the first or
+    the second at random, moves up a level with twice the weight. Lower
+    levels hold fewer values, and the top one is sized for a rank error
+    below ``error`` with 99% probability over these draws, after the KLL
+    error estimate of Apache DataSketches (``2.296 / k ** 0.9``). The
+    draws come from a generator seeded with ``seed``, whose state is saved
+    with the sketch, so that results are reproducible.
+
+    With an ``error`` of 0 every value is kept and quantiles are exact, as
+    are those of streams shorter than the top capacity.
+    """
+
+    def __init__(self, error: float = 0.0, seed=None):
+
+        if not 0 <= error < 1:
+            raise ValueError(f"Sketch error {error} is not in [0, 1)")
+        self.error = error
+        self.capacity = (math.ceil((2.296 / error) ** (1 / 0.9)) if error
+                         else 0)
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray) -> None:
+        """Add values to the sketch; NaN values are skipped."""
+
+        values = np.asarray(values, dtype="float64")
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other: QuantileSketch) -> QuantileSketch:
+        """Add the values summarized by ``other``, level by level."""
+
+        if other.error != self.error:
+            raise ValueError(f"Cannot merge sketches of error {self.error} "
+                             f"and {other.error}")
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], values])
+        self.count += other.count
+        self._compress()
+
+        return self
+
+    def quantile(self, q: float) -> float:
+        """Quantile interpolated between the closest ranks, as pandas does."""
+
+        if not self.count:
+            return math.nan
+
+        if len(self.levels) == 1:
+            values = np.sort(self.levels[0])
+            position = (len(values) - 1) * q
+            lower = values[math.floor(position)]
+            upper = values[math.ceil(position)]
+            return lower + (upper - lower) * (position - math.floor(position))
+
+        # Each value stands for ``weight`` values, centered on its rank
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_values), 2.0 ** level)
+                                  for level, level_values
+                                  in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, weights = values[order], weights[order]
+        ranks = np.cumsum(weights) - (weights + 1) / 2
+
+        return float(np.interp((self.count - 1) * q, ranks, values))
+
+    def _level_capacity(self, level: int) -> int:
+        depth = len(self.levels) - 1 - level
+        return max(2, math.ceil(self.capacity * (2 / 3) ** depth))
+
+    def _compress(self) -> None:
+
+        if not self.capacity:
+            return
+
+        # Adding a level lowers the capacity of those below, so compact
+        # until every level fits
+        compacted = True
+        while compacted:
+            compacted = False
+            for level in range(len(self.levels)):
+                values = self.levels[level]
+                if len(values) <= self._level_capacity(level):
+                    continue
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                # An odd value out stays, so that weights add up to count
+                values = np.sort(values)
+                odd = len(values) % 2
+                promoted = values[odd:][self.rng.integers(2)::2]
+                self.levels[level] = values[:odd]
+                self.levels[level + 1] = np.concatenate(
+                    [self.levels[level + 1], promoted])
+                compacted = True
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "rng": self.rng.bit_generator.state,
+                "levels": [values.tolist() for values in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data: dict, error: float) -> QuantileSketch:
+
+        sketch = cls(error)
+        sketch.count = data["count"]
+        sketch.rng.bit_generator.state = data["rng"]
+        sketch.levels = [np.asarray(values, dtype="float64")
+                         for values in data["levels"]]
+
+        return sketch
+
+
+class SampleSummaries:
+    """Per-sample accumulators of a segment stream, mergeable across shards.
+
+    For each sample, a QuantileSketch of the normalized segment lengths,
+    and the altered length and whether any segment is altered at each
+    ploidy: all that the classification needs. ``ploidy`` is as in
+    call_patterns. Samples can be split across the merged summaries.
+    Sketches are seeded by ``seed`` and the sample name; shards add their
+    index to ``seed``, so that the parts of a sample draw independently.
+    """
+
+    def __init__(self, ploidy: int | list[int] | str = 2,
+                 error: float = 0.0, seed: int | list[int] = 0):
+
+        self.ploidy = ploidy
+        self.error = error
+        self.seed = seed
+        self.sketches: dict[str, QuantileSketch] = {}
+        self.altered_length: dict[str, np.ndarray] = {}
+        self.altered: dict[str, np.ndarray] = {}
+        self.ploidies: dict[str, set] = {}
+
+    def update(self, segment_length: pd.DataFrame) -> None:
+        """Add segments, as output by normalized_scna_length."""
+
+        if isinstance(self.ploidy, str):
+            ploidy = segment_length[self.ploidy].to_numpy()[:, None]
+        elif isinstance(self.ploidy, list):
+            ploidy = [self.ploidy]
+        else:
+            ploidy = self.ploidy
+        altered = adjust_call(segment_length, ploidy) != 0
+        altered_length = np.where(
+            altered, segment_length["length"].to_numpy("float64")[:, None], 0)
+        normalized_length = segment_length["normalized_length"].to_numpy(
+            "float64")
+
+        for sample, rows in segment_length.groupby(
+                "sample", observed=True, sort=False).indices.items():
+            sample = str(sample)
+            if sample not in self.sketches:
+                self.sketches[sample] = QuantileSketch(
+                    self.error, _sample_seed(self.seed, sample))
+                self.altered_length[sample] = np.zeros(altered.shape[1])
+                self.altered[sample] = np.zeros(altered.shape[1], dtype=bool)
+            self.sketches[sample].update(normalized_length[rows])
+            self.altered_length[sample] += altered_length[rows].sum(axis=0)
+            self.altered[sample] |= altered[rows].any(axis=0)
+            if isinstance(self.ploidy, str):
+                self.ploidies.setdefault(sample, set()).update(
+                    np.unique(ploidy[rows]).tolist())
+
+    def merge(self, other: SampleSummaries) -> SampleSummaries:
+
+        if (other.ploidy, other.error) != (self.ploidy, self.error):
+            raise ValueError("Cannot merge summaries of different ploidy "
+                             "or sketch error")
+        for sample, sketch in other.sketches.items():
+            if sample not in self.sketches:
+                self.sketches[sample] = QuantileSketch(
+                    self.error, _sample_seed(self.seed, sample))
+                self.altered_length[sample] = np.zeros_like(
+                    other.altered_length[sample])
+                self.altered[sample] = np.zeros_like(other.altered[sample])
+            self.sketches[sample].merge(sketch)
+            self.altered_length[sample] += other.altered_length[sample]
+            self.altered[sample] |= other.altered[sample]
+            if sample in other.ploidies:
+                self.ploidies.setdefault(sample, set()).update(
+                    other.ploidies[sample])
+
+        return self
+
+    def summary(self) -> pd.DataFrame:
+        """The per-sample table of call_patterns, sorted by sample."""
+
+        samples = pd.Index(sorted(self.sketches), name="sample")
+        if isinstance(self.ploidy, str):
+            ambiguous = [sample for sample in samples
+                         if len(self.ploidies[sample]) > 1]
+            if ambiguous:
+                raise ValueError(f"Samples with more than one {self.ploidy}: "
+                                 f"{', '.join(ambiguous)}")
+
+        normalized_length = pd.DataFrame(
+            {"normalized_length": [self.sketches[sample].quantile(0.75)
+                                   for sample in samples]},
+            index=samples)
+        width = len(self.ploidy) if isinstance(self.ploidy, list) else 1
+        altered_length = np.reshape(
+            [self.altered_length[sample] for sample in samples], (-1, width))
+        altered = np.reshape([self.altered[sample] for sample in samples],
+                             (-1, width))
+        cnb = copy_number_burden(
+            pd.DataFrame(altered_length, index=samples)).where(altered)
+
+        sample_ploidy = None
+        if isinstance(self.ploidy, str):
+            sample_ploidy = pd.Series(
+                [min(self.ploidies[sample]) for sample in samples],
+                index=samples)
+
+        return summary_table(normalized_length, cnb, self.ploidy,
+                             sample_ploidy)
+
+    def write(self, path: str | Path) -> None:
+        """Save the summaries, to merge them with those of other shards."""
+
+        data = {
+            "version": SKETCH_VERSION,
+            "ploidy": self.ploidy,
+            "error": self.error,
+            "seed": self.seed,
+            "samples": {
+                sample: {
+                    "sketch": sketch.to_dict(),
+                    "altered_length": self.altered_length[sample].tolist(),
+                    "altered": self.altered[sample].tolist(),
+                    "ploidies": sorted(self.ploidies.get(sample, ())),
+                }
+                for sample, sketch in self.sketches.items()
+            },
+        }
+        with open(path, "w") as handle:
+            json.dump(data, handle)
+
+    @classmethod
+    def read(cls, path: str | Path) -> SampleSummaries:
+
+        with open(path) as handle:
+            data = json.load(handle)
+        if data.get("version") != SKETCH_VERSION:
+            raise ValueError(f"{path} is not a version {SKETCH_VERSION} "
+                             "sketch file")
+
+        summaries = cls(data["ploidy"], data["error"], data["seed"])
+        for sample, values in data["samples"].items():
+            summaries.sketches[sample] = QuantileSketch.from_dict(
+                values["sketch"], summaries.error)
+            summaries.altered_length[sample] = np.asarray(
+                values["altered_length"], dtype="float64")
+            summaries.altered[sample] = np.asarray(values["altered"],
+                                                   dtype=bool)
+            if values["ploidies"]:
+                summaries.ploidies[sample] = set(values["ploidies"])
+
+        return summaries
+
+
+def stream_patterns(chunks, arm_data: pd.DataFrame,
+                    ploidy: int | list[int] | str = 2,
+                    sketch_error: float = 0.0,
+                    chromosome_workers: int = 1,
+                    summaries: SampleSummaries | None = None,
+                    seed: int | list[int] = 0) -> SampleSummaries:
+    """call_patterns as a single pass over chunks of prepared segments.
+
+    The chunks may hold any mix of samples, in any order: only the
+    per-sample accumulators are kept between them. Pass ``summaries`` to
+    add to earlier ones, or ``seed`` to seed new ones. The result is
+    classified by classify_patterns on its summary().
+    """
+
+    if summaries is None:
+        summaries = SampleSummaries(ploidy, sketch_error, seed)
+
+    for segments in chunks:
+        with PROFILER.stage("interval_join") as stage:
+            segment_length = normalized_scna_length(segments, arm_data,
+                                                    chromosome_workers)
+            stage.rows = len(segment_length)
+
+        with PROFILER.stage("aggregation") as stage:
+            summaries.update(segment_length)
+            stage.rows = len(segment_length)
+
+    return summaries
+
+
+def stream_segment_file(source: str | Path, arm_data: pd.DataFrame,
+                        file_format: str | None,
+                        ploidy: int | list[int] | str = 2,
+                        sample_column: str = "sample",
+                        chunksize: int = 1_000_000,
+                        sketch_error: float = 0.0,
+                        chromosome_workers: int = 1,
+                        seed: int | list[int] = 0) -> SampleSummaries:
+    """Summarize the samples of a segment file in one pass, in any order.
+
+    Files without ``sample_column`` hold one sample, named after the file.
+    """
+
+    file_format = resolve_format(source, file_format)
+    raw_names = {_clean_name(name): name for name in read_column_names(source)}
+    extra = (ploidy,) if isinstance(ploidy, str) else ()
+    columns = segment_columns(source, file_format, extra)
+    if columns is not None and sample_column in raw_names \
+            and raw_names[sample_column] not in columns:
+        columns.append(raw_names[sample_column])
+    contigs = arm_contigs(arm_data)
+
+    def chunks():
+        reader = iter_segment_chunks(
+            source, chunksize, columns=columns,
+            dtype={raw_names[sample_column]: "str"}
+            if sample_column in raw_names else None)
+        while True:
+            with PROFILER.stage("input_parsing") as stage:
+                chunk = next(reader, None)
+                if chunk is not None:
+                    chunk = chunk.clean_names()
+                    if sample_column in chunk:
+                        chunk = chunk.rename(columns={sample_column: "sample"})
+                    else:
+                        chunk["sample"] = Path(source).stem
+                    chunk = compact_segments(chunk, file_format)
+                    stage.rows = len(chunk)
+            if chunk is None:
+                return
+            yield prepare_segments(chunk, file_format, contigs)
+
+    return stream_patterns(chunks(), arm_data, ploidy, sketch_error,
+                           chromosome_workers, seed=seed)
+
+
+def _run_stream_shard(source: str, shard: int
+                      ) -> tuple[SampleSummaries, dict]:
+
+    PROFILER.reset(_worker_state["profile"])
+    settings = _worker_state["settings"]
+    summaries = stream_segment_file(
+        source, _worker_state["arm_data"],
+        **{**settings, "seed": [settings.get("seed", 0), shard]})
+
+    return summaries, PROFILER.stages
+
+
+def stream_files(sources: list[str], arm_data: pd.DataFrame,
+                 workers: int = 1, **settings) -> SampleSummaries:
+    """Stream segment files (shards of a cohort) and merge their summaries.
+
+    ``settings`` are passed on to stream_segment_file. Sources ending in
+    SKETCH_SUFFIX are summaries written by earlier passes, and are merged
+    in as they are. With several ``workers``, files are streamed in a
+    process pool.
+    """
+
+    partials = [source for source in sources
+                if str(source).endswith(SKETCH_SUFFIX)]
+    shards = [source for source in sources if source not in partials]
+
+    profile = PROFILER.enabled
+    parent_stages = PROFILER.stages
+    if workers > 1 and len(shards) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_batch_worker,
+                initargs=(arm_data, settings, profile,
+                          tuple(_FORMAT_MODULES))) as executor:
+            results = list(executor.map(_run_stream_shard, shards,
+                                        range(len(shards))))
+    else:
+        _init_batch_worker(arm_data, settings, profile)
+        results = [_run_stream_shard(source, shard)
+                   for shard, source in enumerate(shards)]
+
+    PROFILER.reset(profile)
+    PROFILER.merge(parent_stages)
+    for _, stages in results:
+        PROFILER.merge(stages)
+
+    summaries = SampleSummaries(settings.get("ploidy", 2),
+                                settings.get("sketch_error", 0.0),
+                                settings.get("seed", 0))
+    with PROFILER.stage("aggregation"):
+        for partial, _ in results:
+            summaries.merge(partial)
+        for source in partials:
+            summaries.merge(SampleSummaries.read(source))
+
+    return summaries
+
+
+# Pure-Python path for small inputs, which skips importing numpy, pandas
+# and pyjanitor. It mirrors prepare_segments and call_patterns; anything it
+# cannot handle falls back to the pandas path.
+
+SMALL_INPUT_ROWS = 20_000
+
+_MISSING_VALUES = {"", "NA", "NaN", "nan", "N/A", "NULL", "null"}
+
+
+def _clean_name(name: str) -> str:
+    # Same result as pyjanitor's clean_names() with default options
+    name = re.sub(r"['\u2019]", "", str(name).lower())
+    return re.sub(r"[ /:,?()\.-]", "_", name)
+
+
+def _arm_bands(genome: str, cytoband: str | Path | None,
+               cache_dir: str | Path | None
+               ) -> list[tuple[str, str, int, int]] | None:
+
+    if cytoband is not None:
+        return read_cytoband(cytoband)
+    if genome in BUILTIN_GENOMES:
+        return _builtin_bands(genome)
+    try:
+        registry = json.loads(_registry_path(
+            Path(cache_dir or default_cache_dir())).read_text())
+        return read_cytoband(registry[genome]["cytoband"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _linear_quantile(values: list[float], q: float) -> float:
+    # Linear interpolation with the formula of pandas' groupby().quantile(),
+    # which the pandas path uses, so that both agree to the last bit
+    if not values:
+        return math.nan
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    lower = math.floor(position)
+    upper = min(lower + 1, len(values) - 1)
+    fraction = position - lower
+    return values[lower] + (values[upper] - values[lower]) * fraction
+
+
+def classify_values(length: float, cnb: float,
+                    thresholds: Thresholds = Thresholds()
+                    ) -> tuple[str | None, str]:
+    """Scalar counterpart of classify_patterns: returns (pattern, reason)."""
+
+    if math.isnan(cnb):
+        reason = "no_cnb"
+    elif math.isnan(length):
+        reason = "no_length"
+    elif length >= thresholds.length:
+        reason = ("long_low_cnb" if cnb < thresholds.stable_cnb
+                  else "long_high_cnb")
+    elif cnb >= thresholds.unstable_cnb:
+        reason = "short_very_high_cnb"
+    else:
+        reason = "short_high_cnb"
+
+    return REASONS[reason], reason
+
+
+def classify_small_file(source: str | Path,
+                        bands: list[tuple[str, str, int, int]],
+                        file_format: str, ploidy: int = 2,
+                        sample_name: str | None = None,
+                        thresholds: Thresholds = Thresholds(),
+                        max_rows: int = SMALL_INPUT_ROWS) -> list[tuple] | None:
+    """Classify a small segment file without pandas.
+
+    Returns rows of (sample, normalized_length, cnb, pattern, reason), or
+    None if the file is too large or not something this path handles.
+    """
+
+    segment_format = SEGMENT_FORMATS.get(file_format)
+    if (segment_format is None or segment_format.transform is not None
+            or table_format(source) != "tsv"):
+        return None
+
+    chromosome_column = segment_format.source("chromosome")
+    cn_column = segment_format.source("absolute_cn")
+    with open(source, "rb") as handle:
+        compressed = handle.read(2) == b"\x1f\x8b"
+    opener = gzip.open if compressed else open
+    # Anything this reader cannot decode is left to pandas
+    try:
+        with PROFILER.stage("input_parsing") as stage, \
+                opener(source, "rt", newline="") as handle:
+            reader = csv.reader(handle, delimiter="\t")
+            header = [_clean_name(name) for name in next(reader, [])]
+            rows = []
+            for row in reader:
+                rows.append(row)
+                if len(rows) > max_rows:
+                    return None
+            stage.rows = len(rows)
+    except (UnicodeDecodeError, csv.Error, OSError, EOFError):
+        return None
+
+    if not sample_name and file_format == "ace":
+        sample_name = Path(source).stem
+    needed = [chromosome_column, segment_format.source("start"),
+              segment_format.source("end"), cn_column]
+    if not sample_name:
+        needed.append("sample")
+    if not set(needed).issubset(header):
+        return None
+    positions = [header.index(column) for column in needed]
+
+    try:
+        segments = []
+        for row in rows:
+            chromosome, start, end, cn = (row[i] for i in positions[:4])
+            sample = sample_name or row[positions[4]]
+            cn = math.nan if cn in _MISSING_VALUES else float(cn)
+            segments.append((chromosome, int(start), int(end), cn, sample))
+    except (ValueError, IndexError):
+        return None
+
+    with PROFILER.stage("chromosome_style") as stage:
+        aliases = contig_aliases(tuple(dict.fromkeys(
+            band[0] for band in bands)))
+        names = {name: aliases.get(name) for name in
+                 {segment[0] for segment in segments}}
+        if None in names.values():
+            return None
+        segments = [(names[segment[0]], *segment[1:])
+                    for segment in segments]
+        stage.rows = len(segments)
+
+    arms = {}
+    for chromosome, name, start, end in sorted(bands):
+        arms.setdefault(chromosome, []).append((start, end, name))
+    chromosome_lengths = {
+        chromosome: max(arm[1] for arm in extents)
+        - min(arm[0] for arm in extents)
+        for chromosome, extents in arms.items()}
+    arm_ends = {chromosome: [arm[1] for arm in extents]
+                for chromosome, extents in arms.items()}
+    arm_starts = {chromosome: [arm[0] for arm in extents]
+                  for chromosome, extents in arms.items()}
+
+    # Arm assignment and aggregation happen in the same pass here
+    with PROFILER.stage("interval_join") as stage:
+        lengths = {}
+        burden = {}
+        for chromosome, start, end, cn, sample in segments:
+            lengths.setdefault(sample, [])
+            length = end - start
+            if chromosome in arms:
+                first = bisect.bisect_right(arm_ends[chromosome], start)
+                last = bisect.bisect_left(arm_starts[chromosome], end) - 1
+                if last == first:
+                    arm_start, arm_end, _ = arms[chromosome][first]
+                    lengths[sample].append(length / (arm_end - arm_start))
+                elif last > first:
+                    lengths[sample].append(
+                        length / chromosome_lengths[chromosome])
+            if cn - ploidy != 0:
+                burden[sample] = burden.get(sample, 0) + length
+        stage.rows = len(segments)
+
+    with PROFILER.stage("classification") as stage:
+        results = []
+        for sample in sorted(lengths):
+            length = _linear_quantile(lengths[sample], 0.75)
+            if sample in burden:
+                cnb = round(burden[sample] / 3e9 * 100 * 10_000) / 10_000
+            else:
+                cnb = math.nan
+            results.append((sample, length, cnb,
+                            *classify_values(length, cnb, thresholds)))
+        stage.rows = len(results)
+
+    return results
+
+
+def write_small_table(rows: list[tuple], destination: str | Path) -> None:
+
+    def formatted(value):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return ""
+        return str(value)
+
+    with open(destination, "w", newline="") as handle:
+        writer = csv.writer(handle, delimiter="\t", lineterminator="\n")
+        writer.writerow(["sample", "normalized_length", "cnb", "pattern",
+                         "reason"])
+        for row in rows:
+            writer.writerow([formatted(value) for value in row])
+
+
+# Cohort matrix of copy number (relative to ploidy) on fixed genome bins,
+# stored as raw rows that can be memory-mapped
+
+BINNED_MATRIX_VERSION = 1
+
+
+def genome_bins(arm_data: pd.DataFrame, bin_size: int) -> pd.DataFrame:
+    """Fixed-size bins tiling each chromosome of the arm table."""
+
+    extents = (arm_data.groupby("Chromosome", sort=False)
+               .agg(start=("Start", "min"), end=("End", "max")))
+    extents = extents.loc[sorted(extents.index, key=_natural_key)]
+
+    bins = []
+    for chromosome, (start, end) in extents.iterrows():
+        starts = np.arange(start, end, bin_size, dtype="int64")
+        bins.append(pd.DataFrame({
+            "chromosome": chromosome, "start": starts,
+            "end": np.minimum(starts + bin_size, end)}))
+
+    return pd.concat(bins, ignore_index=True)
+
+
+def rasterize_segments(segments: pd.DataFrame, bins: pd.DataFrame,
+                       ploidy: int | str = 2) -> np.ndarray:
+    """Length-weighted mean copy number minus ploidy of one sample per bin.
+
+    Bins not covered by any segment (or only by segments without a copy
+    number) are NaN. ``ploidy`` may name a column, as in call_patterns.
+    """
+
+    contigs = pd.Index(bins["chromosome"].unique())
+    bin_contig = contigs.get_indexer(bins["chromosome"]).astype("int64")
+    bin_start = (bin_contig << 32) + bins["start"].to_numpy("int64")
+    bin_end = (bin_contig << 32) + bins["end"].to_numpy("int64")
+
+    if isinstance(ploidy, str):
+        ploidy = segments[ploidy].to_numpy()[:, None]
+    call = adjust_call(segments, ploidy)[:, 0]
+    segment_contig = contigs.get_indexer(
+        segments["chromosome"]).astype("int64")
+    keep = (segment_contig >= 0) & ~np.isnan(call)
+    segment_contig = segment_contig[keep]
+    call = call[keep]
+    segment_start = ((segment_contig << 32)
+                     + segments["start"].to_numpy("int64")[keep])
+    segment_end = ((segment_contig << 32)
+                   + segments["end"].to_numpy("int64")[keep])
+
+    # Expand each segment into one (segment, bin) pair per bin it overlaps
+    first = np.searchsorted(bin_end, segment_start, side="right")
+    last = np.searchsorted(bin_start, segment_end, side="left") - 1
+    counts = np.maximum(last - first + 1, 0)
+    segment = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.cumsum(counts) - counts
+    bin_index = first[segment] + np.arange(len(segment)) - offsets[segment]
+
+    overlap = (np.minimum(segment_end[segment], bin_end[bin_index])
+               - np.maximum(segment_start[segment], bin_start[bin_index]))
+    covered = np.bincount(bin_index, weights=overlap, minlength=len(bins))
+    weighted = np.bincount(bin_index, weights=overlap * call[segment],
+                           minlength=len(bins))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(covered > 0, weighted / covered, np.nan)
+
+
+class BinnedMatrix:
+    """Samples x bins float32 matrix in a directory, appended one row at a time.
+
+    The directory holds ``matrix.f32`` (raw rows), ``samples.tsv`` (one
+    sample per row, in order), ``bins.tsv`` and ``meta.json``. Writers
+    hold an exclusive lock while appending, and read only the samples
+    listed since their last append, by them or other writers. New rows
+    are written before their sample is listed, so readers never see them
+    incomplete. A sample written again is overwritten in place: readers
+    of the matrix meanwhile may see its row half updated.
+    """
+
+    def __init__(self, directory: str | Path, bins: pd.DataFrame,
+                 genome: str, bin_size: int):
+        self.directory = Path(directory)
+        self.bins = bins
+        self.meta = {"version": BINNED_MATRIX_VERSION, "genome": genome,
+                     "bin_size": bin_size, "bins": len(bins),
+                     "dtype": "float32"}
+        # Row of each listed sample, and how much of samples.tsv that covers
+        self._rows: dict[str, int] = {}
+        self._listed_rows = 0
+        self._listed_bytes = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._locked():
+            meta_path = self.directory / "meta.json"
+            if meta_path.exists():
+                existing = json.loads(meta_path.read_text())
+                if existing != self.meta:
+                    raise ValueError(
+                        f"{self.directory} holds a matrix for "
+                        f"{existing['genome']} with {existing['bin_size']} bp "
+                        f"bins, not {genome} with {bin_size} bp bins")
+            else:
+                bins.to_csv(self.directory / "bins.tsv", sep="\t",
+                            index=False)
+                (self.directory / "samples.tsv").touch()
+                (self.directory / "matrix.f32").touch()
+                meta_path.write_text(json.dumps(self.meta, indent=2))
+            self._read_samples()
+
+    def _read_samples(self) -> None:
+
+        with open(self.directory / "samples.tsv", "rb") as handle:
+            handle.seek(self._listed_bytes)
+            listed = handle.read()
+        # A name without its newline was cut short by an interrupted writer
+        listed = listed[:listed.rfind(b"\n") + 1]
+        self._listed_bytes += len(listed)
+        for sample in listed.decode().splitlines():
+            self._rows.setdefault(sample, self._listed_rows)
+            self._listed_rows += 1
+
+    @contextlib.contextmanager
+    def _locked(self):
+        import fcntl
+
+        with open(self.directory / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def append(self, sample: str, row: np.ndarray) -> None:
+
+        row = np.ascontiguousarray(row, dtype="float32")
+        if row.shape != (len(self.bins),):
+            raise ValueError(f"Expected {len(self.bins)} bins, "
+                             f"got {row.shape}")
+
+        sample = str(sample)
+        with self._locked():
+            self._read_samples()
+            # New rows go after the last listed sample, over any bytes
+            # left by an interrupted writer
+            position = self._rows.get(sample, self._listed_rows)
+            with open(self.directory / "matrix.f32", "r+b") as handle:
+                handle.seek(position * row.nbytes)
+                handle.write(row.tobytes())
+                handle.flush()
+                os.fsync(handle.fileno())
+            if position == self._listed_rows:
+                line = f"{sample}\n".encode()
+                with open(self.directory / "samples.tsv", "r+b") as handle:
+                    handle.truncate(self._listed_bytes)
+                    handle.seek(self._listed_bytes)
+                    handle.write(line)
+                self._rows[sample] = position
+                self._listed_rows += 1
+                self._listed_bytes += len(line)
+
+    def add_segments(self, segments: pd.DataFrame,
+                     ploidy: int | str = 2) -> None:
+        """Rasterize and append each sample of prepared ``segments``."""
+
+        if isinstance(ploidy, list):
+            raise ValueError("The binned matrix needs one ploidy per sample")
+
+        with PROFILER.stage("binning") as stage:
+            for sample, group in segments.groupby("sample", observed=True,
+                                                  sort=False):
+                self.append(sample,
+                            rasterize_segments(group, self.bins, ploidy))
+            stage.rows = len(segments)
+
+
+def load_binned_matrix(directory: str | Path
+                       ) -> tuple[np.memmap, pd.Index, pd.DataFrame]:
+    """Memory-map a binned matrix: (matrix, samples, bins), without copying."""
+
+    directory = Path(directory)
+    meta = json.loads((directory / "meta.json").read_text())
+    bins = pd.read_table(directory / "bins.tsv",
+                         dtype={"chromosome": "category"})
+    samples = (directory / "samples.tsv").read_text().splitlines()
+
+    row_bytes = meta["bins"] * np.dtype(meta["dtype"]).itemsize
+    rows = min(len(samples),
+               (directory / "matrix.f32").stat().st_size // row_bytes)
+    if rows == 0:
+        matrix = np.empty((0, meta["bins"]), dtype=meta["dtype"])
+    else:
+        matrix = np.memmap(directory / "matrix.f32", dtype=meta["dtype"],
+                           mode="r", shape=(rows, meta["bins"]))
+
+    return matrix, pd.Index(samples[:rows], name="sample"), bins
+
+
+RESULT_COLUMNS = ("sample", "normalized_length", "cnb", "pattern", "reason")
+
+
+def rows_to_table(rows: list[tuple]) -> pd.DataFrame:
+    return pd.DataFrame.from_records(
+        rows, columns=RESULT_COLUMNS).set_index("sample")
+
+
+def file_digest(path: str | Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Content-addressed store of classification results, one file per key.
+
+    Keys hash the segment file contents with every setting that affects the
+    result, so a hit does not depend on where the file lives. Entries are
+    written to a temporary file and renamed into place, which is atomic on
+    POSIX and NFS, so concurrent writers of the same key are harmless and
+    readers never see partial entries. Reads refresh the modification time,
+    which eviction uses as the least-recently-used order.
+    """
+
+    EVICT_EVERY = 256
+    STALE_SECONDS = 3600
+
+    def __init__(self, directory: str | Path, max_bytes: int = 512 * 2**20,
+                 **context):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.context = {"version": __version__, **context}
+        self._digests = {}
+        self._puts = 0
+
+    def key(self, source: str | Path, file_format: str, ploidy: int,
+            thresholds: Thresholds, sample_name: str | None,
+            compact_gap: int | None = None) -> str:
+
+        # The same file may be looked up by several code paths
+        stat = os.stat(source)
+        marker = (str(source), stat.st_size, stat.st_mtime_ns)
+        if marker not in self._digests:
+            self._digests[marker] = file_digest(source)
+
+        # A given sample name only relabels the result, so only whether
+        # there is one is part of the key
+        fields = {**self.context, "content": self._digests[marker],
+                  "file_format": file_format, "ploidy": ploidy,
+                  "thresholds": thresholds._asdict(),
+                  "named": bool(sample_name)}
+        if compact_gap is not None:
+            fields["compact_gap"] = compact_gap
+        return hashlib.sha256(
+            json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str, sample_name: str | None = None
+            ) -> list[tuple] | None:
+        """Rows of (sample, normalized_length, cnb, pattern, reason) or None."""
+
+        path = self._path(key)
+        try:
+            with open(path) as handle:
+                entry = json.load(handle)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if entry.get("key") != key:
+            return None
+
+        rows = [tuple(row) for row in entry["rows"]]
+        if sample_name:
+            rows = [(sample_name, *row[1:]) for row in rows]
+        return rows
+
+    def put(self, key: str, rows: list[tuple]) -> None:
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handle = tempfile.NamedTemporaryFile(
+            "w", dir=path.parent, prefix=f".{key}.", suffix=".tmp",
+            delete=False)
+        try:
+            with handle:
+                json.dump({"key": key, "rows": [list(row) for row in rows]},
+                          handle)
+            os.replace(handle.name, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(handle.name)
+            raise
+
+        self._puts += 1
+        if self._puts % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop least recently used entries until the cache fits max_bytes."""
+
+        entries = []
+        now = time.time()
+        for path in self.directory.glob("*/*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            # Left behind by writers that died before renaming
+            if path.suffix == ".tmp":
+                if now - stat.st_mtime > self.STALE_SECONDS:
+                    with contextlib.suppress(OSError):
+                        path.unlink()
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        excess = sum(size for _, size, _ in entries) - self.max_bytes
+        for _, size, path in sorted(entries):
+            if excess <= 0:
+                break
+            # Another process may be evicting the same entry
+            with contextlib.suppress(OSError):
+                path.unlink()
+            excess -= size
+
+
+class BatchTask(NamedTuple):
+    sample: str
+    filename: str
+    ploidy: int
+    file_format: str | None
+
+
+def read_batch_samplesheet(samplesheet: str | Path) -> list[BatchTask]:
+    """Read a sample,filename,ploidy[,format] samplesheet (as used by the pipeline).
+
+    Samples without a format have it detected from their file.
+    """
+
+    with open(samplesheet, newline="") as handle:
+        reader = csv.DictReader(handle)
+        missing = {"sample", "filename", "ploidy"}.difference(
+            reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Samplesheet {samplesheet} lacks the "
+                             f"columns: {', '.join(sorted(missing))}")
+        tasks = [BatchTask(row["sample"], row["filename"], int(row["ploidy"]),
+                           row.get("format") or None) for row in reader]
+
+    return tasks
+
+
+_worker_state = {}
+
+
+def _init_batch_worker(arm_data: pd.DataFrame, settings: dict,
+                       profile: bool = False,
+                       format_modules: tuple[str, ...] = ()) -> None:
+    # Workers that were not forked need the third-party formats again
+    for module in format_modules:
+        if module not in _FORMAT_MODULES:
+            load_format_module(module)
+    _worker_state["arm_data"] = arm_data
+    _worker_state["settings"] = settings
+    _worker_state["profile"] = profile
+
+
+def _run_batch_task(task: BatchTask) -> tuple[BatchTask, pd.DataFrame | None,
+                                              str | None, dict]:
+
+    # Stage timings are returned with each result, so that they can be
+    # merged in the parent process when running in a pool
+    PROFILER.reset(_worker_state["profile"])
+
+    # Errors are returned rather than raised so that one bad sample does not
+    # take the whole batch down
+    try:
+        table = classify_segment_file(
+            task.filename, _worker_state["arm_data"], task.file_format,
+            ploidy=task.ploidy, sample_name=task.sample,
+            **_worker_state["settings"])
+    except Exception as error:
+        return task, None, f"{type(error).__name__}: {error}", PROFILER.stages
+
+    return task, table, None, PROFILER.stages
+
+
+def run_batch(tasks: list[BatchTask], arm_data: pd.DataFrame,
+              workers: int = 1, **settings
+              ) -> tuple[pd.DataFrame, list[tuple[BatchTask, str]]]:
+    """Classify many samples, sharing one arm table across a process pool.
+
+    ``settings`` are passed on to ``classify_segment_file``. Returns the
+    cohort classification table (in input order) and the list of samples
+    that failed, with their error messages.
+    """
+
+    profile = PROFILER.enabled
+    parent_stages = PROFILER.stages
+
+    if workers > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_batch_worker,
+                initargs=(arm_data, settings, profile,
+                          tuple(_FORMAT_MODULES))) as executor:
+            results = list(executor.map(_run_batch_task, tasks,
+                                        chunksize=chunksize))
+    else:
+        _init_batch_worker(arm_data, settings, profile)
+        results = [_run_batch_task(task) for task in tasks]
+
+    PROFILER.reset(profile)
+    PROFILER.merge(parent_stages)
+    for *_, stages in results:
+        PROFILER.merge(stages)
+
+    tables = [table for _, table, _, _ in results if table is not None]
+    failures = [(task, error) for task, _, error, _ in results
+                if error is not None]
+
+    if tables:
+        cohort = pd.concat(tables)
+    else:
+        cohort = pd.DataFrame(columns=["normalized_length", "cnb", "pattern",
+                                       "reason"])
+        cohort.index.name = "sample"
+
+    return cohort, failures
+
+
+# Out-of-core backend: the arm join and the per-sample aggregation run as
+# one DuckDB query over the segment files, spilling to disk as needed
+
+def _sql_string(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _sql_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def chromosome_arms(arm_data: pd.DataFrame) -> pd.DataFrame:
+    """One row per chromosome with its p and q arm bounds, for SQL joins."""
+
+    rows = []
+    for chromosome, arms in arm_data.sort_values("Start").groupby(
+            "Chromosome", sort=False):
+        if len(arms) > 2:
+            raise ValueError(f"More than two arms on {chromosome}")
+        bounds = arms[["Start", "End", "ArmLength"]].to_numpy().tolist()
+        p_arm, q_arm = (bounds + [[None] * 3])[:2]
+        rows.append((chromosome, *p_arm, *q_arm,
+                     arms["End"].max() - arms["Start"].min()))
+
+    return pd.DataFrame(rows, columns=[
+        "chromosome", "p_start", "p_end", "p_length", "q_start", "q_end",
+        "q_length", "chromosome_length"])
+
+
+# duckdb is an optional dependency: the conda environment of the pipeline
+# modules has it, the pipeline container does not
+DUCKDB_MISSING = ("the DuckDB backend needs the optional duckdb package "
+                  "(pip install duckdb, or conda install -c conda-forge "
+                  "python-duckdb)")
+
+
+def classify_with_duckdb(sources: list[str], arm_data: pd.DataFrame,
+                         file_format: str | None,
+                         ploidy: int | list[int] | str = 2,
+                         thresholds: Thresholds = Thresholds(),
+                         sample_column: str = "sample",
+                         threads: int | None = None,
+                         memory_limit: str | None = None,
+                         temp_directory: str | None = None) -> pd.DataFrame:
+    """Classify TSV or Parquet segment files without loading them in memory.
+
+    The files are read by DuckDB, which assigns segments to arms, takes
+    the per-sample normalized length quantile and sums the altered length
+    in a single query, spilling to ``temp_directory`` beyond
+    ``memory_limit``. Samples come from ``sample_column``, or from the file
+    names when the files lack it. Only the per-sample summaries reach
+    pandas, where CNB rounding and classification are shared with
+    call_patterns.
+    """
+
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError(DUCKDB_MISSING) from None
+
+    file_format = resolve_format(sources[0], file_format)
+    segment_format = get_segment_format(file_format)
+    if segment_format.transform is not None:
+        raise ValueError(f"The DuckDB backend cannot read {file_format} "
+                         "segments, which need a transform")
+
+    raw_names = {_clean_name(name): name
+                 for name in read_column_names(sources[0])}
+
+    def column(name: str) -> str:
+        try:
+            return _sql_identifier(raw_names[name])
+        except KeyError:
+            raise ValueError(f"No {name} column in {sources[0]}") from None
+
+    files = "[" + ", ".join(_sql_string(source) for source in sources) + "]"
+    by_file = sample_column not in raw_names
+    match table_format(sources[0]):
+        case "parquet":
+            reader = (f"read_parquet({files}, union_by_name = true, "
+                      f"filename = {str(by_file).lower()})")
+        case "tsv":
+            missing = ", ".join(map(_sql_string, sorted(_MISSING_VALUES)))
+            reader = (f"read_csv({files}, delim = '\t', header = true, "
+                      f"nullstr = [{missing}], union_by_name = true, "
+                      f"filename = {str(by_file).lower()})")
+        case other:
+            raise ValueError(f"The DuckDB backend cannot read {other} files")
+
+    sample = ("parse_filename(filename, true)" if by_file
+              else f"CAST({column(sample_column)} AS VARCHAR)")
+    chromosome = (f"CAST({column(segment_format.source('chromosome'))} "
+                  "AS VARCHAR)")
+
+    if isinstance(ploidy, str):
+        ploidy_column = f", {column(ploidy)} AS ploidy"
+        ploidies = ["ploidy"]
+        sample_ploidy = (", min(ploidy) AS ploidy, "
+                         "count(DISTINCT ploidy) AS ploidies")
+    else:
+        ploidy_column = ""
+        ploidies = [float(value) for value in
+                    (ploidy if isinstance(ploidy, list) else [ploidy])]
+        sample_ploidy = ""
+    # Segments without a copy number count as altered, as in pandas
+    burdens = ", ".join(
+        f"sum(length) FILTER (WHERE cn IS NULL OR cn <> {value}) "
+        f"AS burden_{i}" for i, value in enumerate(ploidies))
+
+    # Chromosome names are matched to the arm table through their aliases
+    # (see contig_aliases). An arm hit is a segment overlapping the arm;
+    # more than one hit means that the segment spans the centromere (see
+    # assign_arms). The quantile is interpolated from its two closest ranks
+    # as pandas does, since quantile_cont() can differ in the last bit.
+    query = f"""
+        WITH segments AS (
+            SELECT {sample} AS sample,
+                   coalesce(alias_contig, {chromosome}) AS chromosome,
+                   CAST({column(segment_format.source('start'))} AS BIGINT)
+                       AS start_position,
+                   CAST({column(segment_format.source('end'))} AS BIGINT)
+                       AS end_position,
+                   CAST({column(segment_format.source('absolute_cn'))}
+                        AS DOUBLE) AS cn
+                   {ploidy_column}
+            FROM {reader}
+                LEFT JOIN aliases ON alias_name = {chromosome}
+        ),
+        hits AS (
+            SELECT segments.*,
+                   end_position - start_position AS length,
+                   p_end > start_position AND p_start < end_position AS on_p,
+                   q_end > start_position AND q_start < end_position AS on_q,
+                   p_length, q_length, chromosome_length
+            FROM segments LEFT JOIN arms USING (chromosome)
+        ),
+        placed AS (
+            SELECT *, length / CASE
+                WHEN on_p AND coalesce(on_q, false) THEN chromosome_length
+                WHEN on_p THEN p_length
+                WHEN on_q THEN q_length END AS normalized_length
+            FROM hits
+        ),
+        ranked AS (
+            SELECT sample, normalized_length,
+                   row_number() OVER (PARTITION BY sample
+                                      ORDER BY normalized_length) - 1 AS rank,
+                   (count(*) OVER (PARTITION BY sample) - 1) * 0.75::DOUBLE
+                       AS position
+            FROM placed
+            WHERE normalized_length IS NOT NULL
+        ),
+        quantiles AS (
+            SELECT sample,
+                   any_value(normalized_length)
+                       FILTER (WHERE rank = floor(position)) AS lower,
+                   any_value(normalized_length)
+                       FILTER (WHERE rank = ceil(position)) AS upper,
+                   any_value(position - floor(position)) AS fraction
+            FROM ranked
+            WHERE rank = floor(position) OR rank = ceil(position)
+            GROUP BY sample
+        ),
+        burdens AS (
+            SELECT sample, {burdens} {sample_ploidy}
+            FROM placed
+            GROUP BY sample
+        )
+        SELECT burdens.*,
+               lower + (upper - lower) * fraction AS normalized_length
+        FROM burdens LEFT JOIN quantiles USING (sample)
+        ORDER BY sample
+    """
+
+    config = {"preserve_insertion_order": False}
+    if threads:
+        config["threads"] = threads
+    if memory_limit:
+        config["memory_limit"] = memory_limit
+    if temp_directory:
+        config["temp_directory"] = temp_directory
+
+    with PROFILER.stage("aggregation") as stage, \
+            duckdb.connect(config=config) as connection:
+        connection.register("arms", chromosome_arms(arm_data))
+        connection.register("aliases", pd.DataFrame(
+            contig_aliases(arm_contigs(arm_data)).items(),
+            columns=["alias_name", "alias_contig"]))
+        summary = connection.execute(query).df().set_index("sample")
+        stage.rows = len(summary)
+
+    normalized_length = summary[["normalized_length"]]
+    if isinstance(ploidy, str):
+        ambiguous = summary.index[summary["ploidies"] > 1]
+        if len(ambiguous):
+            raise ValueError(f"Samples with more than one {ploidy}: "
+                             f"{', '.join(map(str, ambiguous))}")
+        merged_table = normalized_length.assign(
+            ploidy=summary["ploidy"],
+            cnb=copy_number_burden(summary["burden_0"]))
+    elif isinstance(ploidy, list):
+        merged_table = pd.concat([
+            normalized_length.assign(
+                ploidy=value, cnb=copy_number_burden(summary[f"burden_{i}"]))
+            for i, value in enumerate(ploidy)
+        ]).sort_index(kind="stable")
+    else:
+        merged_table = normalized_length.assign(
+            cnb=copy_number_burden(summary["burden_0"]))
+
+    if "ploidy" in merged_table:
+        merged_table = merged_table[["ploidy", "normalized_length", "cnb"]]
+
+    with PROFILER.stage("classification") as stage:
+        classified = classify_patterns(merged_table, thresholds)
+        stage.rows = len(classified)
+
+    return classified
+
+
+# Threshold sweep: classification only depends on the per-sample summaries,
+# so a whole grid of cut-offs can be evaluated without the segments
+
+PATTERNS = ("S", "U", "HU", None)
+SWEEP_BLOCK_CELLS = 2**24
+
+
+def threshold_values(text: str) -> list[float]:
+    """Parse a comma-separated list or an inclusive start:stop:step range."""
+
+    if text.count(":") == 2:
+        start, stop, step = (float(value) for value in text.split(":"))
+        if step <= 0 or stop < start:
+            raise argparse.ArgumentTypeError(f"Invalid range {text}")
+        count = math.floor((stop - start) / step + 1e-9) + 1
+        return [round(start + step * i, 10) for i in range(count)]
+    try:
+        return [float(value) for value in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid thresholds {text}")
+
+
+def threshold_grid(length: list[float], stable_cnb: list[float],
+                   unstable_cnb: list[float]) -> pd.DataFrame:
+
+    index = pd.MultiIndex.from_product(
+        [length, stable_cnb, unstable_cnb],
+        names=["length", "stable_cnb", "unstable_cnb"])
+    return index.to_frame(index=False)
+
+
+def read_classification(source: str | Path) -> pd.DataFrame:
+    """Read a classification table written by this script, indexed by sample."""
+
+    match table_format(source):
+        case "parquet":
+            table = pd.read_parquet(source)
+        case "feather":
+            table = pd.read_feather(source)
+        case _:
+            table = pd.read_table(source, dtype={"sample": "str"})
+
+    return table.set_index("sample")
+
 
-    if options.genome_style == "ucsc" and not source.chromosome.str.startswith("chr").all():
-        source = ncbi_to_ucsc(source)
+def pattern_codes(summary: pd.DataFrame, grid: pd.DataFrame) -> np.ndarray:
+    """Codes into PATTERNS for every sample (rows) and grid point (columns).
 
-    if options.genome_style == "ncbi"and not source.chromosome.str.startswith("chr").any():
-        source = ucsc_to_ncbi(source)
+    Follows the rules of classify_patterns, in the same order.
+    """
 
-    source = source.assign(length=source.end.sub(source.start))
+    cnb = summary["cnb"].to_numpy("float64")[:, None]
+    length = summary["normalized_length"].to_numpy("float64")[:, None]
+    long_segments = length >= grid["length"].to_numpy()
+
+    codes = np.where(
+        long_segments,
+        np.where(cnb < grid["stable_cnb"].to_numpy(), 0, 1),
+        np.where(cnb >= grid["unstable_cnb"].to_numpy(), 2, 1),
+    ).astype("int8")
+    codes[np.broadcast_to(np.isnan(length), codes.shape)] = 3
+    codes[np.broadcast_to(np.isnan(cnb), codes.shape)] = 0
+
+    return codes
+
+
+def sweep_thresholds(summary: pd.DataFrame, grid: pd.DataFrame,
+                     reference: pd.Series | None = None
+                     ) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Classify every sample of ``summary`` at every point of ``grid``.
+
+    Returns the pattern counts per grid point (with the agreement with the
+    ``reference`` patterns, when given) and, per sample, the share of the
+    grid giving each pattern. The grid is processed in blocks so that
+    memory stays bounded for large cohorts and grids.
+    """
+
+    names = [pattern or "NA" for pattern in PATTERNS]
+    counts = np.zeros((len(grid), len(PATTERNS)), dtype="int64")
+    per_sample = np.zeros((len(summary), len(PATTERNS)), dtype="int64")
+
+    if reference is not None:
+        reference = reference.reindex(summary.index)
+        compared = reference.notna().to_numpy()
+        expected = pd.Categorical(reference[compared],
+                                  categories=names[:-1]).codes[:, None]
+        agreement = np.zeros(len(grid), dtype="int64")
+
+    block = max(1, SWEEP_BLOCK_CELLS // max(1, len(summary)))
+    for start in range(0, len(grid), block):
+        stop = min(start + block, len(grid))
+        codes = pattern_codes(summary, grid.iloc[start:stop])
+        for code in range(len(PATTERNS)):
+            matches = codes == code
+            counts[start:stop, code] = matches.sum(axis=0)
+            per_sample[:, code] += matches.sum(axis=1)
+        if reference is not None:
+            agreement[start:stop] = (codes[compared] == expected).sum(axis=0)
+
+    pattern_counts = grid.assign(**dict(zip(names, counts.T)))
+    if reference is not None:
+        pattern_counts["compared"] = int(compared.sum())
+        pattern_counts["agreement"] = (
+            agreement / compared.sum() if compared.any() else np.nan)
+
+    stability = pd.DataFrame(per_sample / len(grid), index=summary.index,
+                             columns=names)
+    consensus = stability[names].idxmax(axis=1)
+    stability["consensus"] = consensus.where(consensus != "NA")
+    stability["stability"] = stability[names].max(axis=1)
+
+    return pattern_counts.set_index(list(grid.columns)), stability
+
+
+def run_sweep(sources: list[str], destination: str, grid: pd.DataFrame,
+              thresholds: Thresholds, reference: str | None = None,
+              stability_destination: str | None = None) -> None:
+
+    with PROFILER.stage("input_parsing") as stage:
+        summary = pd.concat([read_classification(source)
+                             for source in sources])
+        patterns = None
+        if reference is not None:
+            patterns = read_classification(reference)["pattern"]
+        stage.rows = len(summary)
+
+    with PROFILER.stage("classification") as stage:
+        pattern_counts, stability = sweep_thresholds(summary, grid, patterns)
+        # The patterns at the chosen cut-offs, to see which samples move
+        stability.insert(0, "pattern", classify_patterns(
+            summary, thresholds)["pattern"])
+        stage.rows = len(grid) * len(summary)
+
+    with PROFILER.stage("output") as stage:
+        write_table(pattern_counts, destination)
+        write_table(stability,
+                    stability_destination or f"{destination}.stability.tsv")
+        stage.rows = len(pattern_counts)
+
+
+# Server mode: keeps the imports and the arm table warm between requests
+
+MAX_REQUEST_BYTES = 256 * 2**20
+
+
+class ClassificationService:
+    """Fixed pool of worker threads fed by a bounded queue of jobs."""
+
+    def __init__(self, arm_data: pd.DataFrame, settings: dict,
+                 workers: int = 2, queue_size: int = 16):
+        self.arm_data = arm_data
+        self.settings = settings
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._threads = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._jobs.qsize()
+
+    def _work(self) -> None:
+        while True:
+            future, request = self._jobs.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self.classify(request))
+                except Exception as error:
+                    future.set_exception(error)
+            self._jobs.task_done()
+
+    def submit(self, request: dict) -> Future:
+        """Queue a request; raises queue.Full when the queue is saturated."""
+
+        from concurrent.futures import Future
+
+        future = Future()
+        self._jobs.put_nowait((future, request))
+        return future
+
+    def classify(self, request: dict) -> pd.DataFrame:
+
+        settings = dict(self.settings)
+        # genome_style is still accepted from older clients, and ignored
+        if "sample_name" in request:
+            settings["sample_name"] = request["sample_name"]
+        if "ploidy" in request or "ploidy_column" in request:
+            settings["ploidy"] = _request_ploidy(request)
+        thresholds = settings["thresholds"]._asdict()
+        for key in thresholds:
+            if key in request:
+                thresholds[key] = float(request[key])
+        settings["thresholds"] = Thresholds(**thresholds)
+        file_format = request.get("file_format") or request.get("format")
+
+        if "path" in request:
+            return classify_segment_file(request["path"], self.arm_data,
+                                         file_format, **settings)
+
+        settings.pop("cache", None)
+        payload = request.get("segments")
+        if isinstance(payload, str):
+            segments = pd.read_table(io.StringIO(payload))
+        elif isinstance(payload, list):
+            segments = pd.DataFrame.from_records(payload)
+        else:
+            raise ValueError("Requests need either a path or segments")
+
+        return classify_segments(segments, self.arm_data, file_format,
+                                 **settings)
+
+
+def _request_ploidy(request: dict) -> int | list[int] | str:
+    """The ploidy setting of a request, as --ploidy or --ploidy-column."""
+
+    if "ploidy_column" in request:
+        return _clean_name(request["ploidy_column"])
+
+    value = request["ploidy"]
+    if isinstance(value, str):
+        try:
+            return ploidy_values(value)
+        except argparse.ArgumentTypeError as error:
+            raise ValueError(f"{error}: ploidy must be a whole number or a "
+                             "list of them (use ploidy_column to name a "
+                             "column)") from None
+    values = value if isinstance(value, list) else [value]
+    if not values or not all(isinstance(item, int)
+                             and not isinstance(item, bool)
+                             for item in values):
+        raise ValueError(f"Invalid ploidy {value!r}: ploidy must be a whole "
+                         "number or a list of them (use ploidy_column to "
+                         "name a column)")
+    return value
+
+
+def serve(service: ClassificationService, port: int | None = None,
+          socket_path: str | None = None) -> None:
+    """Answer classification requests on a Unix socket or a localhost port.
+
+    POST /classify takes a JSON object with either "path" (a segment file
+    readable by the server) or "segments" (TSV text or a list of records),
+    plus "file_format" and optionally "ploidy" (a number, a list or a
+    comma-separated string of them), "ploidy_column", "sample_name"
+    and the threshold names. Results are TSV, or JSON with
+    "output": "json" or an Accept: application/json header.
+    GET /health reports the server status.
+    """
+
+    # http.server is only needed here: keep it out of the start-up path
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+
+    class _ClassificationHandler(BaseHTTPRequestHandler):
+
+        server_version = f"scnapattern/{__version__}"
+
+        def address_string(self) -> str:
+            # Unix socket peers have no address
+            return self.client_address[0] if self.client_address else "unix"
+
+        def _reply(self, status: int, body: str, content_type: str) -> None:
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _error(self, status: int, message: str) -> None:
+            self._reply(status, json.dumps({"error": message}),
+                        "application/json")
+
+        def do_GET(self) -> None:
+            if self.path != "/health":
+                self._error(404, f"Unknown endpoint {self.path}")
+                return
+            service = self.server.service
+            self._reply(200, json.dumps({"status": "ok",
+                                         "version": __version__,
+                                         "pending": service.pending}),
+                        "application/json")
+
+        def do_POST(self) -> None:
+            if self.path != "/classify":
+                self._error(404, f"Unknown endpoint {self.path}")
+                return
+
+            size = int(self.headers.get("Content-Length") or 0)
+            if size > MAX_REQUEST_BYTES:
+                self._error(413, "Request too large")
+                return
+            try:
+                request = json.loads(self.rfile.read(size))
+                if not isinstance(request, dict):
+                    raise ValueError("The request must be a JSON object")
+            except ValueError as error:
+                self._error(400, f"Invalid request: {error}")
+                return
+
+            try:
+                table = self.server.service.submit(request).result()
+            except queue.Full:
+                self._error(503, "Too many pending requests")
+                return
+            except (ValueError, KeyError, OSError) as error:
+                self._error(400, f"{type(error).__name__}: {error}")
+                return
+            except Exception as error:
+                self._error(500, f"{type(error).__name__}: {error}")
+                return
+
+            output = request.get("output")
+            if output is None:
+                accept = self.headers.get("Accept", "")
+                output = "json" if "application/json" in accept else "tsv"
+            if output == "json":
+                # Python floats keep their shortest repr, as in the TSV
+                records = (table.reset_index().astype(object)
+                           .where(table.reset_index().notna(), None)
+                           .to_dict(orient="records"))
+                self._reply(200, json.dumps(records), "application/json")
+            else:
+                self._reply(200, table.to_csv(sep="\t", index=True),
+                            "text/tab-separated-values")
+
+    class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+        daemon_threads = True
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = _UnixHTTPServer(socket_path, _ClassificationHandler)
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port),
+                                     _ClassificationHandler)
+    server.service = service
+    # Shut down cleanly (and remove the socket) when the scheduler stops us
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def ploidy_values(text: str) -> int | list[int]:
+
+    try:
+        ploidies = [int(value) for value in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid ploidy {text}")
+    return ploidies[0] if len(ploidies) == 1 else ploidies
 
-    destination = options.destination
 
-    arm_data = get_chromosomal_arm_lengths(genome=options.genome)
+def main():
 
-    classified_sample = call_patterns(source, arm_data,
-                                      options.ploidy)
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [options] source [source ...] destination")
+    parser.add_argument("--ploidy", type=ploidy_values, default=2,
+                        help="Ploidy of the sample, or comma-separated "
+                        "ploidies to evaluate each sample at (one output row "
+                        "per sample and ploidy)")
+    parser.add_argument("--ploidy-column",
+                        help="Take the ploidy of each sample from this "
+                        "column of the segments instead")
+    parser.add_argument("--genome", default="hg38",
+                        help="Genome assembly: hg19, hg38, or one registered "
+                        "with --cytoband")
+    parser.add_argument("--cytoband",
+                        help="Local UCSC-style cytoBand file (optionally "
+                        "gzipped) for the arm boundaries of --genome")
+    parser.add_argument("--arm-cache", default=None,
+                        help="Directory holding the compiled arm indices "
+                        "(default: $SCNAPATTERN_CACHE or ~/.cache/scnapattern)")
+    parser.add_argument("--file-format",
+                        help="Segment format: "
+                        f"{', '.join(SEGMENT_FORMATS)}, or one registered "
+                        "by --format-module (default: detected from the "
+                        "header)")
+    parser.add_argument("--format-module", action="append", default=[],
+                        metavar="MODULE",
+                        help="Python module or .py file registering further "
+                        "segment formats with register_format() "
+                        "(repeatable)")
+    parser.add_argument("--genome-style", choices=("ucsc", "ncbi"),
+                        help="Deprecated and ignored: chromosomes are "
+                        "matched to the arm table in either style, and "
+                        "under the aliases 23, 24 and MT")
+    parser.add_argument("--sample-name", default="Sample")
+    parser.add_argument("--length-threshold", type=float,
+                        default=Thresholds().length,
+                        help="Normalized length separating S/U from U/HU")
+    parser.add_argument("--stable-cnb", type=float,
+                        default=Thresholds().stable_cnb,
+                        help="CNB below which long-segment samples are S")
+    parser.add_argument("--unstable-cnb", type=float,
+                        default=Thresholds().unstable_cnb,
+                        help="CNB from which short-segment samples are HU")
+    parser.add_argument("--multi-sample", action="store_true",
+                        help="The source holds several samples: stream it "
+                        "and classify one sample at a time")
+    parser.add_argument("--sample-column", default="sample",
+                        help="Column identifying samples with --multi-sample")
+    parser.add_argument("--chunksize", type=int, default=1_000_000,
+                        help="Rows read at a time with --multi-sample")
+    parser.add_argument("--stream", action="store_true",
+                        help="Classify the samples of all the sources (shards "
+                        "of a cohort, with samples in any order, and "
+                        f"*{SKETCH_SUFFIX} files of earlier passes) in one "
+                        "pass, keeping only per-sample summaries in memory")
+    parser.add_argument("--sketch-error", type=float, default=0.001,
+                        help="Approximate rank error of the normalized "
+                        "length quantile with --stream, met with 99%% "
+                        "probability over the random draws of the sketch "
+                        "(seeded by --seed; 0 keeps every value, for exact "
+                        "results)")
+    parser.add_argument("--save-sketches", metavar="PATH",
+                        help="With --stream, also save the per-sample "
+                        f"summaries, to merge as a *{SKETCH_SUFFIX} source "
+                        "later")
+    parser.add_argument("--samplesheet",
+                        help="Batch mode: sample,filename,ploidy,format sheet "
+                        "of segment files to classify together")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes used in batch mode, or "
+                        "worker threads in server mode")
+    parser.add_argument("--errors",
+                        help="Batch mode: where to write failed samples "
+                        "(default: <destination>.errors.tsv)")
+    parser.add_argument("--small-input-rows", type=int,
+                        default=SMALL_INPUT_ROWS,
+                        help="Largest single-sample input classified without "
+                        "pandas (0 disables this fast path)")
+    parser.add_argument("--sweep-length", type=threshold_values,
+                        metavar="VALUES",
+                        help="Sweep mode: normalized length cut-offs, as "
+                        "a,b,c or start:stop:step. Sources are then "
+                        "classification tables, and the destination gets "
+                        "the pattern counts for every combination of cut-offs")
+    parser.add_argument("--sweep-stable-cnb", type=threshold_values,
+                        metavar="VALUES",
+                        help="Sweep mode: stable CNB cut-offs")
+    parser.add_argument("--sweep-unstable-cnb", type=threshold_values,
+                        metavar="VALUES",
+                        help="Sweep mode: unstable CNB cut-offs")
+    parser.add_argument("--reference",
+                        help="Sweep mode: table of sample and reference "
+                        "pattern to measure agreement with")
+    parser.add_argument("--stability",
+                        help="Sweep mode: where to write the per-sample "
+                        "pattern shares (default: "
+                        "<destination>.stability.tsv)")
+    parser.add_argument("--bootstrap", type=int, default=0,
+                        metavar="REPLICATES",
+                        help="Add bootstrap confidence intervals and pattern "
+                        "probabilities from this many segment resamplings "
+                        "per sample")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed of --bootstrap and of the "
+                        "--stream quantile sketches")
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="Confidence level of the --bootstrap intervals")
+    parser.add_argument("--backend", choices=("pandas", "duckdb"),
+                        default="pandas",
+                        help="duckdb classifies all the sources (TSV or "
+                        "Parquet, in one format) out of core, spilling to "
+                        "disk, with samples taken from --sample-column or "
+                        "else the file names")
+    parser.add_argument("--memory-limit",
+                        help="DuckDB backend: memory to use before spilling, "
+                        "such as 24GB")
+    parser.add_argument("--temp-directory",
+                        help="DuckDB backend: where to spill")
+    parser.add_argument("--chromosome-workers", type=int, default=1,
+                        help="Threads assigning the segments of large "
+                        f"samples (from {PARALLEL_MIN_ROWS:,} segments) to "
+                        "arms, one chromosome at a time")
+    parser.add_argument("--metrics", nargs="?", const="", default=None,
+                        help="Also write segment counts, CNB, gain/loss CNB, "
+                        "FGA and mean copy number per sample, genome-wide "
+                        "and per arm, as TSV (default: "
+                        "<destination>.metrics.tsv)")
+    parser.add_argument("--compact-gap", type=int, metavar="BP",
+                        help="Merge runs of adjacent segments with the same "
+                        "copy number on the same arm, at most this many bp "
+                        "apart, before the arm join (results are "
+                        "unchanged)")
+    parser.add_argument("--binned-matrix", metavar="DIRECTORY",
+                        help="Also add the copy number of each sample, on "
+                        "fixed genome bins, to the memory-mappable cohort "
+                        "matrix in this directory (may be shared)")
+    parser.add_argument("--bin-size", type=int, default=1_000_000,
+                        help="Bin size in bp of --binned-matrix")
+    parser.add_argument("--result-cache",
+                        help="Directory of a cache of per-file results, keyed "
+                        "by file contents and settings (may be shared)")
+    parser.add_argument("--result-cache-size", type=int, default=512,
+                        help="Size limit of --result-cache in MB, beyond "
+                        "which the least recently used results are dropped")
+    parser.add_argument("--profile", nargs="?", const="", default=None,
+                        help="Record time, CPU, peak memory and rows per "
+                        "stage in a JSON file (default: "
+                        "<destination>.profile.json)")
+    parser.add_argument("--report-import-time", action="store_true",
+                        help="Report time spent importing numpy/pandas")
+    parser.add_argument("--serve-port", type=int,
+                        help="Server mode: answer requests on this "
+                        "localhost port")
+    parser.add_argument("--serve-socket",
+                        help="Server mode: answer requests on this Unix "
+                        "socket")
+    parser.add_argument("--queue-size", type=int, default=16,
+                        help="Server mode: requests waiting for a worker "
+                        "before new ones are refused")
+    parser.add_argument("paths", nargs="*", metavar="source",
+                        help="Source segment file(s), followed by the "
+                        "destination to save to. Files ending in .parquet "
+                        "or .feather are read and written as such, "
+                        "anything else as TSV")
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + __version__)
 
-    classified_sample.to_csv(destination, sep="\t",
-                             index=True)
+    options = parser.parse_args()
+    if options.genome_style is not None:
+        warnings.warn("--genome-style is deprecated and ignored: chromosomes "
+                      "are matched to the arm table in either style")
+    for module in options.format_module:
+        load_format_module(module)
+    if options.file_format and options.file_format not in SEGMENT_FORMATS:
+        parser.error(f"unknown --file-format {options.file_format} (choose "
+                     f"from {', '.join(SEGMENT_FORMATS)})")
+    if options.ploidy_column:
+        options.ploidy = _clean_name(options.ploidy_column)
+    bootstrap = None
+    if options.bootstrap > 0:
+        if not isinstance(options.ploidy, int):
+            parser.error("--bootstrap needs a single ploidy")
+        bootstrap = Bootstrap(options.bootstrap, options.seed,
+                              options.confidence)
+    options.bootstrap = bootstrap
+    if options.binned_matrix and isinstance(options.ploidy, list):
+        parser.error("--binned-matrix needs a single ploidy")
+
+    if options.serve_port or options.serve_socket:
+        if options.paths:
+            parser.error("server mode takes no source or destination")
+        arm_data = get_chromosomal_arm_lengths(genome=options.genome,
+                                               cytoband=options.cytoband,
+                                               cache_dir=options.arm_cache)
+        settings = {"ploidy": options.ploidy,
+                    "sample_name": options.sample_name,
+                    "thresholds": Thresholds(options.length_threshold,
+                                             options.stable_cnb,
+                                             options.unstable_cnb),
+                    "cache": _result_cache(options),
+                    "bootstrap": options.bootstrap,
+                    "matrix": _binned_matrix(options, arm_data),
+                    "compact_gap": options.compact_gap,
+                    "chromosome_workers": options.chromosome_workers}
+        service = ClassificationService(arm_data, settings,
+                                        workers=max(1, options.workers),
+                                        queue_size=options.queue_size)
+        serve(service, port=options.serve_port,
+              socket_path=options.serve_socket)
+        return
+
+    if not options.paths:
+        parser.error("a destination is required")
+    *sources, destination = options.paths
+    if not sources and not options.samplesheet:
+        parser.error("a source segment file or --samplesheet is required")
+    if sources and options.samplesheet:
+        parser.error("source files and --samplesheet are mutually exclusive")
+    if options.multi_sample and len(sources) != 1:
+        parser.error("--multi-sample requires exactly one source file")
+    if (options.sweep_length or options.sweep_stable_cnb
+            or options.sweep_unstable_cnb) and not sources:
+        parser.error("sweep mode requires classification tables as sources")
+    if options.backend == "duckdb" and (
+            options.samplesheet or options.bootstrap or options.binned_matrix
+            or options.compact_gap is not None
+            or options.metrics is not None):
+        parser.error("the DuckDB backend does not support --samplesheet, "
+                     "--bootstrap, --binned-matrix, --compact-gap or "
+                     "--metrics")
+    if options.backend == "duckdb" and importlib.util.find_spec("duckdb") is None:
+        parser.error(DUCKDB_MISSING)
+
+    if options.stream and (
+            options.samplesheet or options.multi_sample
+            or options.backend == "duckdb" or options.bootstrap
+            or options.binned_matrix or options.compact_gap is not None
+            or options.metrics is not None):
+        parser.error("--stream does not support --samplesheet, "
+                     "--multi-sample, the DuckDB backend, --bootstrap, "
+                     "--binned-matrix, --compact-gap or --metrics")
+    if options.save_sketches and not options.stream:
+        parser.error("--save-sketches requires --stream")
+
+    thresholds = Thresholds(options.length_threshold, options.stable_cnb,
+                            options.unstable_cnb)
+    PROFILER.reset(enabled=options.profile is not None)
+    started = time.perf_counter()
+    try:
+        classify(options, sources, destination, thresholds)
+    finally:
+        if PROFILER.enabled:
+            PROFILER.write(
+                options.profile or f"{destination}.profile.json",
+                sample=options.sample_name if len(sources) == 1 else None,
+                output=destination,
+                wall_seconds=round(time.perf_counter() - started, 6),
+                import_seconds=_LazyModule.load_seconds)
+        if options.report_import_time:
+            for module, seconds in _LazyModule.load_seconds.items():
+                print(f"Imported {module} in {seconds:.3f}s", file=sys.stderr)
+
+
+def _result_cache(options: argparse.Namespace) -> ResultCache | None:
+
+    if not options.result_cache:
+        return None
+
+    # The same genome name may stand for different bands (a custom cytoBand
+    # file, a re-registration, a newer built-in table), and format modules
+    # may change how files are read, so both are keyed by contents
+    arm_index = load_arm_index(options.genome, options.cytoband,
+                               options.arm_cache)
+    return ResultCache(options.result_cache,
+                       max_bytes=options.result_cache_size * 2**20,
+                       genome=options.genome,
+                       arm_index=arm_index.checksum,
+                       format_modules=format_module_digests())
+
+
+def _binned_matrix(options: argparse.Namespace,
+                   arm_data: pd.DataFrame) -> BinnedMatrix | None:
+
+    if not options.binned_matrix:
+        return None
+
+    return BinnedMatrix(options.binned_matrix,
+                        genome_bins(arm_data, options.bin_size),
+                        genome=options.genome, bin_size=options.bin_size)
+
+
+def classify(options: argparse.Namespace, sources: list[str],
+             destination: str, thresholds: Thresholds) -> None:
+
+    if options.sweep_length or options.sweep_stable_cnb \
+            or options.sweep_unstable_cnb:
+        grid = threshold_grid(
+            options.sweep_length or [thresholds.length],
+            options.sweep_stable_cnb or [thresholds.stable_cnb],
+            options.sweep_unstable_cnb or [thresholds.unstable_cnb])
+        run_sweep(sources, destination, grid, thresholds,
+                  reference=options.reference,
+                  stability_destination=options.stability)
+        return
+
+    cache = _result_cache(options)
+    try:
+        _classify(options, sources, destination, thresholds, cache)
+    finally:
+        if cache is not None:
+            cache.evict()
+
+
+def _classify(options: argparse.Namespace, sources: list[str],
+              destination: str, thresholds: Thresholds,
+              cache: ResultCache | None) -> None:
+
+    if options.backend == "duckdb":
+        with PROFILER.stage("arm_table") as stage:
+            arm_data = get_chromosomal_arm_lengths(
+                genome=options.genome, cytoband=options.cytoband,
+                cache_dir=options.arm_cache)
+            stage.rows = len(arm_data)
+        classified = classify_with_duckdb(
+            sources, arm_data, options.file_format, ploidy=options.ploidy,
+            thresholds=thresholds,
+            sample_column=options.sample_column,
+            threads=options.workers if options.workers > 1 else None,
+            memory_limit=options.memory_limit,
+            temp_directory=options.temp_directory)
+        with PROFILER.stage("output") as stage:
+            write_table(classified, destination)
+            stage.rows = len(classified)
+        return
+
+    if options.stream:
+        with PROFILER.stage("arm_table") as stage:
+            arm_data = get_chromosomal_arm_lengths(
+                genome=options.genome, cytoband=options.cytoband,
+                cache_dir=options.arm_cache)
+            stage.rows = len(arm_data)
+        summaries = stream_files(
+            sources, arm_data, workers=options.workers,
+            file_format=options.file_format, ploidy=options.ploidy,
+            sample_column=options.sample_column,
+            chunksize=options.chunksize, sketch_error=options.sketch_error,
+            chromosome_workers=options.chromosome_workers, seed=options.seed)
+        if options.save_sketches:
+            summaries.write(options.save_sketches)
+        with PROFILER.stage("classification") as stage:
+            classified = classify_patterns(summaries.summary(), thresholds)
+            stage.rows = len(classified)
+        with PROFILER.stage("output") as stage:
+            write_table(classified, destination)
+            stage.rows = len(classified)
+        return
+
+    if (len(sources) == 1 and not options.multi_sample
+            and options.small_input_rows > 0
+            and isinstance(options.ploidy, int)
+            and options.bootstrap is None
+            and not options.binned_matrix
+            and options.compact_gap is None
+            and options.metrics is None
+            and table_format(destination) == "tsv"):
+        file_format = resolve_format(sources[0], options.file_format)
+        sample_name = options.sample_name
+        if not sample_name and file_format == "ace":
+            sample_name = Path(sources[0]).stem
+        rows = None
+        if cache is not None:
+            key = cache.key(sources[0], file_format, options.ploidy,
+                            thresholds, sample_name)
+            rows = cache.get(key, sample_name)
+
+        if rows is None:
+            with PROFILER.stage("arm_table"):
+                bands = _arm_bands(options.genome, options.cytoband,
+                                   options.arm_cache)
+            if bands is not None:
+                rows = classify_small_file(
+                    sources[0], bands, file_format,
+                    ploidy=options.ploidy, sample_name=sample_name, thresholds=thresholds,
+                    max_rows=options.small_input_rows)
+            if rows is not None and cache is not None:
+                cache.put(key, rows)
+
+        if rows is not None:
+            with PROFILER.stage("output") as stage:
+                write_small_table(rows, destination)
+                stage.rows = len(rows)
+            return
+
+    with PROFILER.stage("arm_table") as stage:
+        arm_data = get_chromosomal_arm_lengths(genome=options.genome,
+                                               cytoband=options.cytoband,
+                                               cache_dir=options.arm_cache)
+        stage.rows = len(arm_data)
+
+    matrix = _binned_matrix(options, arm_data)
+    metrics = (MetricsTable(options.metrics or f"{destination}.metrics.tsv")
+               if options.metrics is not None else None)
+
+    if options.multi_sample:
+        classify_multi_sample_file(
+            sources[0], destination, arm_data, options.file_format,
+            ploidy=options.ploidy, thresholds=thresholds,
+            sample_column=options.sample_column,
+            chunksize=options.chunksize, bootstrap=options.bootstrap,
+            matrix=matrix, compact_gap=options.compact_gap,
+            chromosome_workers=options.chromosome_workers, metrics=metrics)
+        return
+
+    if len(sources) == 1:
+        classified_sample = classify_segment_file(
+            sources[0], arm_data, options.file_format, ploidy=options.ploidy,
+            sample_name=options.sample_name, thresholds=thresholds,
+            cache=cache, bootstrap=options.bootstrap, matrix=matrix,
+            compact_gap=options.compact_gap,
+            chromosome_workers=options.chromosome_workers, metrics=metrics)
+
+        with PROFILER.stage("output") as stage:
+            write_table(classified_sample, destination)
+            stage.rows = len(classified_sample)
+        return
+
+    if options.samplesheet:
+        tasks = read_batch_samplesheet(options.samplesheet)
+    else:
+        tasks = [BatchTask(Path(source).stem, source, options.ploidy,
+                           options.file_format) for source in sources]
+
+    cohort, failures = run_batch(tasks, arm_data, workers=options.workers,
+                                 thresholds=thresholds, cache=cache,
+                                 bootstrap=options.bootstrap, matrix=matrix,
+                                 compact_gap=options.compact_gap,
+                                 metrics=metrics)
+
+    with PROFILER.stage("output") as stage:
+        write_table(cohort, destination)
+        stage.rows = len(cohort)
+
+    if failures:
+        errors = options.errors or f"{destination}.errors.tsv"
+        with open(errors, "w", newline="") as handle:
+            writer = csv.writer(handle, delimiter="\t")
+            writer.writerow(["sample", "filename", "error"])
+            for task, error in failures:
+                writer.writerow([task.sample, task.filename, error])
+        print(f"{len(failures)} of {len(tasks)} samples failed, see {errors}",
+              file=sys.stderr)
+        if len(failures) == len(tasks):
+            sys.exit(1)
 
 
 if __name__ == "__main__":
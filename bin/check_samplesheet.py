@@ -1,133 +1,210 @@
 #!/usr/bin/env python
 
 
-"""Provide a command line tool to validate and transform tabular samplesheets."""
+"""Validate a segment samplesheet and the head of every segment file it lists."""
 
 
 import argparse
 import csv
+import gzip
+import importlib
+import itertools
 import logging
 import sys
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from calculate_scnapattern import (
+    SEGMENT_FORMATS,
+    _MISSING_VALUES,
+    _clean_name,
+    _one_based,
+    detect_format,
+    table_format,
+)
+
 logger = logging.getLogger()
 
 
-class RowChecker:
+class SegmentFileChecker:
     """
-    Define a service that can validate and transform each given row.
+    Define a service that checks the head of a segment file.
+
+    Only the header and the first ``head_lines`` rows are read, so that the
+    files of a whole cohort can be checked in little time.
 
     Attributes:
-        modified (list): A list of dicts, where each dict corresponds to a previously
-            validated and transformed row. The order of rows is maintained.
+        genome_style (str): The chromosome naming style of the run, ``ucsc``
+            (chr1) or ``ncbi`` (1).
+        head_lines (int): The number of rows read from each file.
+        base_dir (pathlib.Path): The directory relative file names are
+            resolved against.
 
     """
 
-    VALID_FORMATS = (
-        ".fq.gz",
-        ".fastq.gz",
-    )
+    # Rows quoted for each kind of problem, beyond which they are counted
+    MAX_EXAMPLES = 3
 
-    def __init__(
-        self,
-        sample_col="sample",
-        first_col="fastq_1",
-        second_col="fastq_2",
-        single_col="single_end",
-        **kwargs,
-    ):
-        """
-        Initialize the row checker with the expected column names.
+    def __init__(self, genome_style="ucsc", head_lines=1000, base_dir=None):
+        self.genome_style = genome_style
+        self.head_lines = head_lines
+        self.base_dir = Path(base_dir) if base_dir else Path.cwd()
 
-        Args:
-            sample_col (str): The name of the column that contains the sample name
-                (default "sample").
-            first_col (str): The name of the column that contains the first (or only)
-                FASTQ file path (default "fastq_1").
-            second_col (str): The name of the column that contains the second (if any)
-                FASTQ file path (default "fastq_2").
-            single_col (str): The name of the new column that will be inserted and
-                records whether the sample contains single- or paired-end sequencing
-                reads (default "single_end").
-
-        """
-        super().__init__(**kwargs)
-        self._sample_col = sample_col
-        self._first_col = first_col
-        self._second_col = second_col
-        self._single_col = single_col
-        self._seen = set()
-        self.modified = []
-
-    def validate_and_transform(self, row):
+    def check(self, filename, file_format=None, path=None):
         """
-        Perform all validations on the given row and insert the read pairing status.
+        Check one segment file.
 
         Args:
-            row (dict): A mapping from column headers (keys) to elements of that row
-                (values).
+            filename (str): The segment file, as given in the samplesheet.
+            file_format (str): The declared format, if any.
+            path (pathlib.Path): A local copy of the file to read instead,
+                such as one staged by Nextflow.
 
-        """
-        self._validate_sample(row)
-        self._validate_first(row)
-        self._validate_second(row)
-        self._validate_pair(row)
-        self._seen.add((row[self._sample_col], row[self._first_col]))
-        self.modified.append(row)
-
-    def _validate_sample(self, row):
-        """Assert that the sample name exists and convert spaces to underscores."""
-        if len(row[self._sample_col]) <= 0:
-            raise AssertionError("Sample input is required.")
-        # Sanitize samples slightly.
-        row[self._sample_col] = row[self._sample_col].replace(" ", "_")
-
-    def _validate_first(self, row):
-        """Assert that the first FASTQ entry is non-empty and has the right format."""
-        if len(row[self._first_col]) <= 0:
-            raise AssertionError("At least the first FASTQ file is required.")
-        self._validate_fastq_format(row[self._first_col])
-
-    def _validate_second(self, row):
-        """Assert that the second FASTQ entry has the right format if it exists."""
-        if len(row[self._second_col]) > 0:
-            self._validate_fastq_format(row[self._second_col])
-
-    def _validate_pair(self, row):
-        """Assert that read pairs have the same file extension. Report pair status."""
-        if row[self._first_col] and row[self._second_col]:
-            row[self._single_col] = False
-            first_col_suffix = Path(row[self._first_col]).suffixes[-2:]
-            second_col_suffix = Path(row[self._second_col]).suffixes[-2:]
-            if first_col_suffix != second_col_suffix:
-                raise AssertionError("FASTQ pairs must have the same file extensions.")
-        else:
-            row[self._single_col] = True
-
-    def _validate_fastq_format(self, filename):
-        """Assert that a given filename has one of the expected FASTQ extensions."""
-        if not any(filename.endswith(extension) for extension in self.VALID_FORMATS):
-            raise AssertionError(
-                f"The FASTQ file has an unrecognized extension: {filename}\n"
-                f"It should be one of: {', '.join(self.VALID_FORMATS)}"
-            )
+        Returns:
+            tuple: The format of the file (declared or detected, None if
+            unknown) and the list of problems found.
 
-    def validate_unique_samples(self):
         """
-        Assert that the combination of sample name and FASTQ filename is unique.
+        path = Path(path) if path else self.base_dir / filename
+        if not path.is_file():
+            return file_format, [f"Segment file {filename} does not exist."]
 
-        In addition to the validation, also rename all samples to have a suffix of _T{n}, where n is the
-        number of times the same sample exist, but with different FASTQ files, e.g., multiple runs per experiment.
+        try:
+            header, rows = self.read_head(path)
+        except Exception as error:
+            return file_format, [f"Segment file {filename} cannot be read: {error}"]
 
-        """
-        if len(self._seen) != len(self.modified):
-            raise AssertionError("The pair of sample name and FASTQ must be unique.")
-        seen = Counter()
-        for row in self.modified:
-            sample = row[self._sample_col]
-            seen[sample] += 1
-            row[self._sample_col] = f"{sample}_T{seen[sample]}"
+        columns = {_clean_name(name): name for name in header}
+        if not file_format:
+            try:
+                file_format = detect_format(header)
+            except ValueError as error:
+                return None, [f"{error} in {filename}."]
+
+        segment_format = SEGMENT_FORMATS.get(file_format)
+        if segment_format is None:
+            # Reported with the samplesheet columns
+            return file_format, []
+        missing = [column for column in segment_format.signature if column not in columns]
+        if missing:
+            return file_format, [
+                f"Segment file {filename} lacks the {file_format} columns: {', '.join(missing)}."
+            ]
+        if not rows:
+            return file_format, [f"Segment file {filename} has no segments."]
+
+        source = {target: columns.get(name) for name, target in segment_format.columns.items()}
+        # Closed 1-based intervals may start and end on the same base
+        offset = 1 if segment_format.transform is _one_based else 0
+        return file_format, self._check_rows(filename, rows, source, offset)
+
+    def read_head(self, path):
+        """Read the column names and the first rows (as dicts) of a segment file."""
+        match table_format(path):
+            case "parquet":
+                import pyarrow.parquet
+
+                parquet_file = pyarrow.parquet.ParquetFile(path)
+                batch = next(parquet_file.iter_batches(batch_size=self.head_lines), None)
+                return parquet_file.schema_arrow.names, batch.to_pylist() if batch else []
+            case "feather":
+                import pyarrow.ipc
+
+                with pyarrow.ipc.open_file(path) as reader:
+                    if not reader.num_record_batches:
+                        return reader.schema.names, []
+                    batch = reader.get_batch(0).slice(0, self.head_lines)
+                    return reader.schema.names, batch.to_pylist()
+
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", newline="") as handle:
+            reader = csv.reader(handle, delimiter="\t")
+            header = next(reader, [])
+            rows = []
+            for row in itertools.islice(reader, self.head_lines):
+                if len(row) != len(header):
+                    raise ValueError(f"line {reader.line_num} has {len(row)} fields instead of {len(header)}")
+                rows.append(dict(zip(header, row)))
+        return header, rows
+
+    def _check_rows(self, filename, rows, source, offset=0):
+        """Check the coordinates, copy numbers and chromosome names of the rows read."""
+        problems = {}
+
+        def report(problem, line):
+            problems.setdefault(problem, []).append(line)
+
+        chromosomes = set()
+        for line, row in enumerate(rows, start=2):
+            chromosome = _text(row.get(source.get("chromosome")))
+            if chromosome is None:
+                report("no chromosome", line)
+            else:
+                chromosomes.add(chromosome)
+
+            start = _integer(row.get(source.get("start")))
+            if start is not None:
+                start -= offset
+            end = _integer(row.get(source.get("end")))
+            if source.get("start") and start is None:
+                report("a start that is not a whole number", line)
+            if source.get("end") and end is None:
+                report("an end that is not a whole number", line)
+            if start is not None and start < 0:
+                report("a negative start", line)
+            if start is not None and end is not None and end <= start:
+                report("an end not after the start", line)
+
+            for column in ("absolute_cn", "log2"):
+                if source.get(column) and not _is_number(row.get(source[column])):
+                    report(f"a {source[column]} value that is not a number", line)
+
+        messages = []
+        for problem, lines in problems.items():
+            examples = ", ".join(map(str, lines[: self.MAX_EXAMPLES]))
+            more = f" and {len(lines) - self.MAX_EXAMPLES} more" if len(lines) > self.MAX_EXAMPLES else ""
+            messages.append(f"Segment file {filename} has {problem} on line(s) {examples}{more}.")
+
+        # Chromosomes are matched to the arm table in either style, so
+        # naming only deserves a warning
+        prefixed = {chromosome.startswith("chr") for chromosome in chromosomes}
+        if len(prefixed) > 1:
+            logger.warning(f"Segment file {filename} mixes UCSC (chr1) and NCBI (1) chromosome names.")
+        elif prefixed and prefixed.pop() != (self.genome_style == "ucsc"):
+            logger.warning(f"Segment file {filename} does not use {self.genome_style} chromosome names.")
+
+        return messages
+
+
+def _text(value):
+    """Return a value as text, or None when it is missing."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return None if value in _MISSING_VALUES else value
+
+
+def _integer(value):
+    """Return a coordinate as an integer (accepting 1e+06), or None when it is not one."""
+    value = _text(value)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else None
+
+
+def _is_number(value):
+    """Whether a copy number is a number or missing."""
+    value = _text(value)
+    if value is None:
+        return True
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
 
 
 def read_head(handle, num_lines=10):
@@ -162,64 +239,146 @@ def sniff_format(handle):
     return dialect
 
 
-def check_samplesheet(file_in, file_out):
+def check_rows(rows):
     """
-    Check that the tabular samplesheet has the structure expected by nf-core pipelines.
+    Check the samplesheet columns of every row.
 
-    Validate the general shape of the table, expected columns, and each row. Also add
-    an additional column which records whether one or two FASTQ reads were found.
+    Args:
+        rows (list): The samplesheet rows, as dicts.
+
+    Returns:
+        list: The problems found, as (line, message) pairs.
+
+    """
+    problems = []
+    for line, row in enumerate(rows, start=2):
+        sample = row.get("sample") or ""
+        if not sample:
+            problems.append((line, "Sample name is required."))
+        elif any(character.isspace() for character in sample):
+            problems.append((line, f"Sample name {sample!r} contains spaces."))
+        if not row.get("filename"):
+            problems.append((line, "Segment file name is required."))
+        try:
+            if int(row.get("ploidy") or "") < 1:
+                raise ValueError
+        except ValueError:
+            problems.append((line, f"Ploidy {row.get('ploidy')!r} is not a positive whole number."))
+        file_format = row.get("format")
+        if file_format and file_format not in SEGMENT_FORMATS:
+            problems.append(
+                (line, f"Format {file_format!r} is not one of {', '.join(SEGMENT_FORMATS)} (or empty).")
+            )
+
+    counts = Counter(row.get("sample") for row in rows if row.get("sample"))
+    for line, row in enumerate(rows, start=2):
+        if counts[row.get("sample")] > 1:
+            problems.append((line, f"Sample {row['sample']} is listed {counts[row['sample']]} times."))
+
+    return problems
+
+
+def read_staged_files(file_in):
+    """
+    Read the local copies of the segment files, by sample.
+
+    Args:
+        file_in (pathlib.Path): A CSV file with sample and filename columns.
+
+    Returns:
+        dict: The local path of the segment file of each sample.
+
+    """
+    with file_in.open(newline="") as in_handle:
+        return {row["sample"]: Path(row["filename"]) for row in csv.DictReader(in_handle)}
+
+
+def check_samplesheet(
+    file_in, file_out, genome_style="ucsc", head_lines=1000, threads=None, base_dir=None, staged_files=None
+):
+    """
+    Check a segment samplesheet and its segment files, reporting every problem at once.
+
+    The segment files are checked concurrently. Formats left empty in the
+    samplesheet are detected and filled in the validated copy.
 
     Args:
         file_in (pathlib.Path): The given tabular samplesheet. The format can be either
             CSV, TSV, or any other format automatically recognized by ``csv.Sniffer``.
-        file_out (pathlib.Path): Where the validated and transformed samplesheet should
-            be created; always in CSV format.
+        file_out (pathlib.Path): Where the validated samplesheet should be created;
+            always in CSV format.
+        genome_style (str): The chromosome naming style of the run.
+        head_lines (int): The number of rows checked in each segment file.
+        threads (int): The number of files checked at once (default: chosen by
+            ``ThreadPoolExecutor``).
+        base_dir (pathlib.Path): The directory relative segment file names are
+            resolved against (default: the working directory).
+        staged_files (dict): Local copies of the segment files by sample, read
+            instead of the samplesheet paths.
 
     Example:
-        This function checks that the samplesheet follows the following structure,
-        see also the `viral recon samplesheet`_::
-
-            sample,fastq_1,fastq_2
-            SAMPLE_PE,SAMPLE_PE_RUN1_1.fastq.gz,SAMPLE_PE_RUN1_2.fastq.gz
-            SAMPLE_PE,SAMPLE_PE_RUN2_1.fastq.gz,SAMPLE_PE_RUN2_2.fastq.gz
-            SAMPLE_SE,SAMPLE_SE_RUN1_1.fastq.gz,
+        This function checks that the samplesheet follows the following structure::
 
-    .. _viral recon samplesheet:
-        https://raw.githubusercontent.com/nf-core/test-datasets/viralrecon/samplesheet/samplesheet_test_illumina_amplicon.csv
+            sample,filename,ploidy,format
+            Sample_1,Sample1.cna.seg,2,ichorcna
+            Sample_2,Sample2.cns,2,
 
     """
-    required_columns = {"sample", "fastq_1", "fastq_2"}
+    required_columns = {"sample", "filename", "ploidy"}
     # See https://docs.python.org/3.9/library/csv.html#id3 to read up on `newline=""`.
     with file_in.open(newline="") as in_handle:
         reader = csv.DictReader(in_handle, dialect=sniff_format(in_handle))
         # Validate the existence of the expected header columns.
-        if not required_columns.issubset(reader.fieldnames):
-            req_cols = ", ".join(required_columns)
+        if not required_columns.issubset(reader.fieldnames or []):
+            req_cols = ", ".join(sorted(required_columns))
             logger.critical(f"The sample sheet **must** contain these column headers: {req_cols}.")
             sys.exit(1)
-        # Validate each row.
-        checker = RowChecker()
-        for i, row in enumerate(reader):
-            try:
-                checker.validate_and_transform(row)
-            except AssertionError as error:
-                logger.critical(f"{str(error)} On line {i + 2}.")
-                sys.exit(1)
-        checker.validate_unique_samples()
+        rows = list(reader)
+
+    problems = check_rows(rows)
+
+    # pyarrow is imported before the threads start: importing it from
+    # several threads at once can see partially initialized modules
+    if any(table_format(row.get("filename") or "") != "tsv" for row in rows):
+        for module in ("pyarrow.ipc", "pyarrow.parquet"):
+            importlib.import_module(module)
+
+    staged_files = staged_files or {}
+    checker = SegmentFileChecker(genome_style, head_lines, base_dir)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = executor.map(
+            lambda row: (
+                checker.check(row["filename"], row.get("format"), staged_files.get(row.get("sample")))
+                if row.get("filename")
+                else (None, [])
+            ),
+            rows,
+        )
+        for line, (row, (file_format, file_problems)) in enumerate(zip(rows, results), start=2):
+            row["format"] = file_format or row.get("format") or ""
+            problems.extend((line, problem) for problem in file_problems)
+
+    if problems:
+        for line, problem in sorted(problems, key=lambda problem: problem[0]):
+            logger.error(f"Samplesheet line {line}: {problem}")
+        logger.critical(f"Found {len(problems)} problem(s) in {file_in}.")
+        sys.exit(1)
+
     header = list(reader.fieldnames)
-    header.insert(1, "single_end")
+    if "format" not in header:
+        header.append("format")
     # See https://docs.python.org/3.9/library/csv.html#id3 to read up on `newline=""`.
     with file_out.open(mode="w", newline="") as out_handle:
         writer = csv.DictWriter(out_handle, header, delimiter=",")
         writer.writeheader()
-        for row in checker.modified:
+        for row in rows:
             writer.writerow(row)
 
 
 def parse_args(argv=None):
     """Define and immediately parse command line arguments."""
     parser = argparse.ArgumentParser(
-        description="Validate and transform a tabular samplesheet.",
+        description="Validate a segment samplesheet and the segment files it lists.",
         epilog="Example: python check_samplesheet.py samplesheet.csv samplesheet.valid.csv",
     )
     parser.add_argument(
@@ -232,7 +391,35 @@ def parse_args(argv=None):
         "file_out",
         metavar="FILE_OUT",
         type=Path,
-        help="Transformed output samplesheet in CSV format.",
+        help="Validated output samplesheet in CSV format, with detected formats filled in.",
+    )
+    parser.add_argument(
+        "--genome-style",
+        choices=("ucsc", "ncbi"),
+        default="ucsc",
+        help="Chromosome naming style of the run (default ucsc).",
+    )
+    parser.add_argument(
+        "--head-lines",
+        type=int,
+        default=1000,
+        help="Number of segments checked in each file (default 1000).",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="Number of segment files checked at once.",
+    )
+    parser.add_argument(
+        "--base-dir",
+        type=Path,
+        help="Directory that relative segment file names are resolved against (default: working directory).",
+    )
+    parser.add_argument(
+        "--staged-files",
+        type=Path,
+        help="CSV with sample and filename columns giving local copies of the segment files (such as those staged "
+        "by Nextflow), checked instead of the samplesheet paths.",
     )
     parser.add_argument(
         "-l",
@@ -252,7 +439,15 @@ def main(argv=None):
         logger.error(f"The given input file {args.file_in} was not found!")
         sys.exit(2)
     args.file_out.parent.mkdir(parents=True, exist_ok=True)
-    check_samplesheet(args.file_in, args.file_out)
+    check_samplesheet(
+        args.file_in,
+        args.file_out,
+        genome_style=args.genome_style,
+        head_lines=args.head_lines,
+        threads=args.threads,
+        base_dir=args.base_dir,
+        staged_files=read_staged_files(args.staged_files) if args.staged_files else None,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+"""Upsert classification tables into an incremental SQLite cohort store."""
+
+import argparse
+import csv
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+import sqlite3
+import sys
+
+# Samples classified at several ploidies have one row per ploidy; tables
+# without a ploidy column store an empty one. Pattern counts are kept up to
+# date by triggers, so that adding samples never needs a pass over the
+# samples already in the store. (The upsert's conflict clause would override
+# an INSERT OR IGNORE in the triggers.)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS classification (
+    sample            TEXT NOT NULL,
+    ploidy            TEXT NOT NULL DEFAULT '',
+    normalized_length REAL,
+    cnb               REAL,
+    pattern           TEXT,
+    reason            TEXT,
+    run               TEXT,
+    source            TEXT,
+    settings          TEXT,
+    updated_at        TEXT NOT NULL,
+    PRIMARY KEY (sample, ploidy)
+);
+
+CREATE TABLE IF NOT EXISTS pattern_counts (
+    pattern TEXT PRIMARY KEY,
+    samples INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS classification_insert
+AFTER INSERT ON classification
+BEGIN
+    INSERT INTO pattern_counts SELECT IFNULL(NEW.pattern, 'NA'), 0
+        WHERE NOT EXISTS (SELECT 1 FROM pattern_counts
+                          WHERE pattern = IFNULL(NEW.pattern, 'NA'));
+    UPDATE pattern_counts SET samples = samples + 1
+        WHERE pattern = IFNULL(NEW.pattern, 'NA');
+END;
+
+CREATE TRIGGER IF NOT EXISTS classification_update
+AFTER UPDATE OF pattern ON classification
+WHEN OLD.pattern IS NOT NEW.pattern
+BEGIN
+    UPDATE pattern_counts SET samples = samples - 1
+        WHERE pattern = IFNULL(OLD.pattern, 'NA');
+    INSERT INTO pattern_counts SELECT IFNULL(NEW.pattern, 'NA'), 0
+        WHERE NOT EXISTS (SELECT 1 FROM pattern_counts
+                          WHERE pattern = IFNULL(NEW.pattern, 'NA'));
+    UPDATE pattern_counts SET samples = samples + 1
+        WHERE pattern = IFNULL(NEW.pattern, 'NA');
+END;
+
+CREATE TRIGGER IF NOT EXISTS classification_delete
+AFTER DELETE ON classification
+BEGIN
+    UPDATE pattern_counts SET samples = samples - 1
+        WHERE pattern = IFNULL(OLD.pattern, 'NA');
+END;
+"""
+
+# Rows whose values and settings did not change are left alone, keeping
+# their provenance
+UPSERT = """
+INSERT INTO classification VALUES (
+    :sample, :ploidy, :normalized_length, :cnb, :pattern, :reason, :run,
+    :source, :settings, :updated_at)
+ON CONFLICT (sample, ploidy) DO UPDATE SET
+    normalized_length = excluded.normalized_length,
+    cnb = excluded.cnb,
+    pattern = excluded.pattern,
+    reason = excluded.reason,
+    run = excluded.run,
+    source = excluded.source,
+    settings = excluded.settings,
+    updated_at = excluded.updated_at
+WHERE (classification.normalized_length, classification.cnb,
+       classification.pattern, classification.reason,
+       classification.settings)
+    IS NOT (excluded.normalized_length, excluded.cnb, excluded.pattern,
+            excluded.reason, excluded.settings)
+"""
+
+COLUMNS = ("sample", "ploidy", "normalized_length", "cnb", "pattern",
+           "reason")
+OPTIONAL_COLUMNS = {"ploidy": ""}
+
+
+def connect(store: Path, timeout: float = 600) -> sqlite3.Connection:
+    """Open (creating if needed) a cohort store.
+
+    Writers take the database lock up front and wait up to ``timeout``
+    seconds for other runs to finish theirs, so concurrent runs serialize
+    instead of racing. This relies on working file locks, so the store
+    should not live on a filesystem without them.
+    """
+
+    connection = sqlite3.connect(store, timeout=timeout,
+                                 isolation_level=None)
+    connection.executescript(SCHEMA)
+
+    columns = {row[1] for row in connection.execute(
+        "PRAGMA table_info(classification)")}
+    if "ploidy" not in columns:
+        connection.close()
+        raise ValueError(f"{store} predates per-ploidy rows: export it with "
+                         "the previous version and start a new store")
+
+    return connection
+
+
+def read_table(path: Path) -> list[dict]:
+
+    def value(text: str, column: str):
+        if text == "":
+            return None
+        if column in ("normalized_length", "cnb"):
+            return float(text)
+        return text
+
+    with open(path, newline="") as handle:
+        reader = csv.DictReader(handle, delimiter="\t")
+        missing = set(COLUMNS).difference(reader.fieldnames or [],
+                                          OPTIONAL_COLUMNS)
+        if missing:
+            raise ValueError(f"{path} lacks the columns: "
+                             f"{', '.join(sorted(missing))}")
+        return [{column: (value(row[column], column) if column in row
+                          else OPTIONAL_COLUMNS[column])
+                 for column in COLUMNS}
+                for row in reader]
+
+
+def upsert(connection: sqlite3.Connection, tables: list[Path],
+           run: str | None = None, settings: dict | None = None
+           ) -> tuple[int, int]:
+    """Insert or update the samples of ``tables`` in one transaction.
+
+    Returns the number of samples read and the number new or changed.
+    """
+
+    updated_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    settings = json.dumps(settings, sort_keys=True) if settings else None
+
+    rows = {}
+    for table in tables:
+        for row in read_table(table):
+            # Otherwise the last duplicate would silently win
+            key = (row["sample"], row["ploidy"] or "")
+            if key in rows:
+                at_ploidy = f" at ploidy {key[1]}" if key[1] else ""
+                raise ValueError(
+                    f"Sample {key[0]}{at_ploidy} is classified more than "
+                    f"once ({rows[key]['source']}, {table.name})")
+            rows[key] = {**row, "ploidy": key[1], "run": run,
+                         "source": table.name, "settings": settings,
+                         "updated_at": updated_at}
+
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        changed = connection.executemany(UPSERT, rows.values()).rowcount
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+    return len(rows), changed
+
+
+def write_counts(connection: sqlite3.Connection, destination: Path) -> None:
+
+    with open(destination, "w", newline="") as handle:
+        writer = csv.writer(handle, delimiter="\t", lineterminator="\n")
+        writer.writerow(["pattern", "samples"])
+        writer.writerows(connection.execute(
+            "SELECT pattern, samples FROM pattern_counts WHERE samples > 0 "
+            "ORDER BY pattern"))
+
+
+def export(connection: sqlite3.Connection, destination: Path) -> None:
+    """Write the whole cohort as a classification table."""
+
+    with open(destination, "w", newline="") as handle:
+        writer = csv.writer(handle, delimiter="\t", lineterminator="\n")
+        writer.writerow(COLUMNS)
+        for row in connection.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM classification "
+                "ORDER BY sample, ploidy"):
+            writer.writerow(["" if value is None else value for value in row])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("tables", nargs="*", type=Path,
+                        help="Classification tables from "
+                        "calculate_scnapattern.py")
+    parser.add_argument("--store", required=True, type=Path,
+                        help="SQLite database holding the cohort")
+    parser.add_argument("--run", help="Run name recorded with each sample")
+    parser.add_argument("--setting", action="append", default=[],
+                        metavar="KEY=VALUE",
+                        help="Classification setting recorded with each "
+                        "sample (repeatable)")
+    parser.add_argument("--counts", type=Path,
+                        help="Write the number of samples per pattern here")
+    parser.add_argument("--export", type=Path,
+                        help="Write the whole cohort classification here")
+    parser.add_argument("--timeout", type=float, default=600,
+                        help="Seconds to wait for other runs writing to the "
+                        "store")
+    options = parser.parse_args()
+
+    settings = dict(setting.partition("=")[::2] for setting in options.setting)
+
+    connection = connect(options.store, timeout=options.timeout)
+    try:
+        if options.tables:
+            read, changed = upsert(connection, options.tables,
+                                   run=options.run, settings=settings)
+            print(f"{changed} of {read} samples new or changed in "
+                  f"{options.store}", file=sys.stderr)
+        if options.counts:
+            write_counts(connection, options.counts)
+        if options.export:
+            export(connection, options.export)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""Turn calculate_scnapattern.py --profile sidecars into MultiQC custom content."""
+
+import argparse
+import json
+from pathlib import Path
+import statistics
+
+STAGES = ("input_parsing", "chromosome_style", "arm_table", "compaction",
+          "interval_join",
+          "aggregation", "classification", "bootstrap", "binning",
+          "output")
+
+
+def read_profiles(paths: list[Path]) -> dict[str, dict]:
+
+    profiles = {}
+    for path in paths:
+        report = json.loads(path.read_text())
+        name = report.get("sample") or path.name.removesuffix(".profile.json")
+        profiles[name] = report
+
+    return profiles
+
+
+def stage_times(profiles: dict[str, dict]) -> dict:
+    """Stacked bar graph of the wall time of each stage, per sample."""
+
+    data = {
+        name: {stage["name"]: round(stage["wall_seconds"], 6)
+               for stage in report["stages"]}
+        for name, report in profiles.items()
+    }
+
+    return {
+        "id": "scnapattern_stage_times",
+        "section_name": "SCNA pattern stage timings",
+        "description": "Wall time spent by calculate_scnapattern.py in each "
+                       "stage, per task.",
+        "plot_type": "bargraph",
+        "pconfig": {"id": "scnapattern_stage_times_plot",
+                    "title": "calculate_scnapattern.py: time per stage",
+                    "ylab": "Seconds", "cpswitch": True},
+        "categories": [stage for stage in STAGES
+                       if any(stage in row for row in data.values())],
+        "data": data,
+    }
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def stage_distribution(profiles: dict[str, dict]) -> dict:
+    """Cohort-level distribution of wall time, CPU time and memory per stage."""
+
+    per_stage = {}
+    for report in profiles.values():
+        for stage in report["stages"]:
+            per_stage.setdefault(stage["name"], []).append(stage)
+
+    data = {}
+    for name in sorted(per_stage, key=lambda stage: (
+            STAGES.index(stage) if stage in STAGES else len(STAGES), stage)):
+        stages = per_stage[name]
+        wall = [stage["wall_seconds"] for stage in stages]
+        cpu = [stage["cpu_seconds"] for stage in stages]
+        data[name] = {
+            "tasks": len(stages),
+            "wall_median": round(statistics.median(wall), 4),
+            "wall_p90": round(_percentile(wall, 0.9), 4),
+            "wall_max": round(max(wall), 4),
+            "cpu_share": round(sum(cpu) / sum(wall), 3) if sum(wall) else None,
+            "rss_max_mb": max(stage["peak_rss_mb"] for stage in stages),
+            "rows_median": statistics.median(stage["rows"] for stage in stages),
+        }
+        ratios = [stage["compression_ratio"] for stage in stages
+                  if "compression_ratio" in stage]
+        if ratios:
+            data[name]["compression_median"] = round(
+                statistics.median(ratios), 3)
+
+    return {
+        "id": "scnapattern_stage_distribution",
+        "section_name": "SCNA pattern stage distribution",
+        "description": "Distribution of the stage timings across all tasks. "
+                       "A low CPU share points to time spent waiting on I/O.",
+        "plot_type": "table",
+        "pconfig": {"id": "scnapattern_stage_distribution_table",
+                    "title": "calculate_scnapattern.py: stages across the cohort"},
+        "headers": {
+            "tasks": {"title": "Tasks", "format": "{:,.0f}"},
+            "wall_median": {"title": "Median (s)"},
+            "wall_p90": {"title": "90th percentile (s)"},
+            "wall_max": {"title": "Max (s)"},
+            "cpu_share": {"title": "CPU / wall", "max": 1, "min": 0},
+            "rss_max_mb": {"title": "Peak RSS (MB)"},
+            "rows_median": {"title": "Median rows", "format": "{:,.0f}"},
+            "compression_median": {"title": "Median compression",
+                                   "description": "Input rows per row kept"},
+        },
+        "data": data,
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("profiles", nargs="+", type=Path,
+                        help="*.profile.json files")
+    parser.add_argument("--prefix", default="scnapattern",
+                        help="Prefix of the *_mqc.json files written")
+    options = parser.parse_args()
+
+    profiles = read_profiles(options.profiles)
+    for suffix, section in (("stage_times", stage_times(profiles)),
+                            ("stage_distribution",
+                             stage_distribution(profiles))):
+        with open(f"{options.prefix}_{suffix}_mqc.json", "w") as handle:
+            json.dump(section, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
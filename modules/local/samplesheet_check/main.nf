@@ -0,0 +1,53 @@
+process SAMPLESHEET_CHECK {
+    tag "$samplesheet"
+    label 'process_single'
+
+    conda "${moduleDir}/../scnapattern/environment.yaml"
+    container "dincalcilab/pandas-pyranges:0.0.111-f05923d"
+
+    input:
+    path samplesheet
+    tuple val(samples), path(segmentfiles, stageAs: "segments/?/*")
+
+    output:
+    path '*.valid.csv' , emit: csv
+    path "versions.yml", emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script: // This script is bundled with the pipeline, in dincalcilab/scnapattern/bin/
+    def args = task.ext.args ?: ''
+    // The files are checked where they were staged, so that containers and
+    // remote executors see them
+    def rows = [samples, segmentfiles instanceof List ? segmentfiles : [segmentfiles]]
+        .transpose()
+        .collect { sample, segmentfile -> "${sample},${segmentfile}" }
+    def staged = (["sample,filename"] + rows).join('\\n')
+
+    """
+    printf '%b\\n' "${staged}" > staged_segments.csv
+
+    check_samplesheet.py \\
+        $args \\
+        --threads $task.cpus \\
+        --staged-files staged_segments.csv \\
+        $samplesheet \\
+        samplesheet.valid.csv
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //')
+    END_VERSIONS
+    """
+
+    stub:
+    """
+    cp $samplesheet samplesheet.valid.csv
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //')
+    END_VERSIONS
+    """
+}
@@ -9,9 +9,12 @@ process CALCULATE_SCNAPATTERN {
 
     input:
     tuple val(meta), path(segmentfile)
+    path cytoband
 
     output:
     tuple val(meta), path("*_classification.txt"), emit: table
+    path "*.profile.json"                        , emit: profile, optional: true
+    tuple val(meta), path("*.metrics.tsv")       , emit: metrics, optional: true
     path "versions.yml"                          , emit: versions
 
     when:
@@ -20,15 +23,18 @@ process CALCULATE_SCNAPATTERN {
     script:
     def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
-    def format = "${meta.format}"
+    def format_arg = meta.format ? "--file-format ${meta.format}" : ''
     def ploidy = "${meta.ploidy}"
+    def cytoband_arg = cytoband ? "--cytoband ${cytoband}" : ''
 
     """
 
     calculate_scnapattern.py \\
         --ploidy $ploidy \\
-        --file-format $format \\
+        $format_arg \\
         --sample-name $prefix \\
+        --chromosome-workers $task.cpus \\
+        $cytoband_arg \\
         $args \\
         $segmentfile \\
         ${prefix}_classification.txt
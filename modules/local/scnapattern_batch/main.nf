@@ -0,0 +1,61 @@
+
+process CALCULATE_SCNAPATTERN_BATCH {
+    tag "$meta.id"
+    label 'process_medium'
+
+    conda "${moduleDir}/../scnapattern/environment.yaml"
+    container "dincalcilab/pandas-pyranges:0.0.111-f05923d"
+
+    input:
+    tuple val(meta), val(samples), path(segmentfiles, stageAs: "segments/?/*")
+    path cytoband
+
+    output:
+    tuple val(meta), path("*_classification.txt"), emit: table
+    tuple val(meta), path("*.errors.tsv")        , emit: errors, optional: true
+    path "*.profile.json"                        , emit: profile, optional: true
+    tuple val(meta), path("*.metrics.tsv")       , emit: metrics, optional: true
+    path "versions.yml"                          , emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    def prefix = task.ext.prefix ?: "${meta.id}"
+    def cytoband_arg = cytoband ? "--cytoband ${cytoband}" : ''
+    def rows = [samples, segmentfiles instanceof List ? segmentfiles : [segmentfiles]]
+        .transpose()
+        .collect { sample, segmentfile -> "${sample.id},${segmentfile},${sample.ploidy},${sample.format ?: ''}" }
+    def samplesheet = (["sample,filename,ploidy,format"] + rows).join('\\n')
+
+    """
+    printf '%b\\n' "${samplesheet}" > ${prefix}_samplesheet.csv
+
+    calculate_scnapattern.py \\
+        --samplesheet ${prefix}_samplesheet.csv \\
+        --workers $task.cpus \\
+        $cytoband_arg \\
+        $args \\
+        ${prefix}_classification.txt
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        scnapattern: \$(calculate_scnapattern.py --version |& sed '1!d ; s/calculate_scnapattern.py //')
+    END_VERSIONS
+    """
+
+    stub:
+    def args = task.ext.args ?: ''
+    def prefix = task.ext.prefix ?: "${meta.id}"
+
+    """
+
+    touch ${prefix}_classification.txt
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        scnapattern: \$(calculate_scnapattern.py --version | sed 's/calculate_scnapattern.py //')
+    END_VERSIONS
+    """
+}
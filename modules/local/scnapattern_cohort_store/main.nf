@@ -0,0 +1,46 @@
+process SCNAPATTERN_COHORT_STORE {
+    label 'process_single'
+
+    conda "${moduleDir}/../scnapattern/environment.yaml"
+    container "dincalcilab/pandas-pyranges:0.0.111-f05923d"
+
+    input:
+    path tables, stageAs: "tables/*"
+    val store
+
+    output:
+    path "pattern_counts.tsv", emit: counts
+    path "versions.yml"      , emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+
+    // The store lives outside the work directory and is updated in place
+    """
+    cohort_store.py \\
+        --store ${store} \\
+        --counts pattern_counts.tsv \\
+        $args \\
+        $tables
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //')
+        sqlite: \$(python -c 'import sqlite3; print(sqlite3.sqlite_version)')
+    END_VERSIONS
+    """
+
+    stub:
+    """
+    touch pattern_counts.tsv
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //')
+        sqlite: \$(python -c 'import sqlite3; print(sqlite3.sqlite_version)')
+    END_VERSIONS
+    """
+}
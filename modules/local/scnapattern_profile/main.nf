@@ -0,0 +1,42 @@
+
+process SCNAPATTERN_PROFILE_MQC {
+    label 'process_single'
+
+    conda "${moduleDir}/../scnapattern/environment.yaml"
+    container "dincalcilab/pandas-pyranges:0.0.111-f05923d"
+
+    input:
+    path profiles, stageAs: "profiles/*"
+
+    output:
+    path "*_mqc.json"  , emit: mqc
+    path "versions.yml", emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+
+    """
+    summarize_profiles.py \\
+        $args \\
+        $profiles
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //')
+    END_VERSIONS
+    """
+
+    stub:
+    """
+    touch scnapattern_stage_times_mqc.json
+    touch scnapattern_stage_distribution_mqc.json
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //')
+    END_VERSIONS
+    """
+}
@@ -32,7 +32,11 @@ ch_multiqc_custom_methods_description = params.multiqc_methods_description ? fil
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 */
 
-include { CALCULATE_SCNAPATTERN      } from '../modules/local/scnapattern/main'
+include { SAMPLESHEET_CHECK           } from '../modules/local/samplesheet_check/main'
+include { CALCULATE_SCNAPATTERN       } from '../modules/local/scnapattern/main'
+include { CALCULATE_SCNAPATTERN_BATCH } from '../modules/local/scnapattern_batch/main'
+include { SCNAPATTERN_PROFILE_MQC     } from '../modules/local/scnapattern_profile/main'
+include { SCNAPATTERN_COHORT_STORE    } from '../modules/local/scnapattern_cohort_store/main'
 
 /*
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -64,15 +68,76 @@ workflow SCNAPATTERN {
                 [meta, filename]
     }
 
-    CALCULATE_SCNAPATTERN(ch_input)
+    if (params.validate_segments) {
+        ch_segments = ch_input
+            .filter { meta, filename -> filename }
+            .toList()
+            .map { rows -> [rows.collect { it[0].id }, rows.collect { it[1] }] }
+        SAMPLESHEET_CHECK(file(params.input, checkIfExists: true), ch_segments)
+
+        // Hold back every sample until all the segment files have been
+        // checked, and take the formats detected for those left empty
+        ch_formats = SAMPLESHEET_CHECK.out.csv
+            .splitCsv(header: true)
+            .map { row -> [row.sample, row.format] }
+        ch_input = ch_input
+            .map { meta, filename -> [meta.id, meta, filename] }
+            .join(ch_formats)
+            .map { id, meta, filename, format -> [meta + [format: format], filename] }
+        ch_versions = ch_versions.mix(SAMPLESHEET_CHECK.out.versions)
+    }
+
+    // Shared directories must exist before containers can mount them
+    [params.result_cache, params.binned_matrix].findAll { it }.each { directory ->
+        file(directory).mkdirs()
+    }
 
-    CALCULATE_SCNAPATTERN.out.table.map{ meta, filepath -> filepath }
-                         .collectFile(storeDir: "${params.outdir}/summary/",
-                                      name: 'pattern_classification.seg',
-                                      keepHeader: true,
-                                      skip: 1)
+    ch_cytoband = params.cytoband ? file(params.cytoband, checkIfExists: true) : []
+
+    if (params.batch_size > 1) {
+        // Send samples in chunks to a single process, to amortize the start-up cost
+        ch_batches = ch_input
+            .collate(params.batch_size)
+            .toList()
+            .flatMap { chunks ->
+                chunks.withIndex().collect { chunk, index ->
+                    [[id: "batch_${index + 1}"], chunk.collect { it[0] }, chunk.collect { it[1] }]
+                }
+            }
+
+        CALCULATE_SCNAPATTERN_BATCH(ch_batches, ch_cytoband)
+        ch_tables   = CALCULATE_SCNAPATTERN_BATCH.out.table
+        ch_profiles = CALCULATE_SCNAPATTERN_BATCH.out.profile
+        ch_versions = ch_versions.mix(CALCULATE_SCNAPATTERN_BATCH.out.versions)
+    } else {
+        CALCULATE_SCNAPATTERN(ch_input, ch_cytoband)
+        ch_tables   = CALCULATE_SCNAPATTERN.out.table
+        ch_profiles = CALCULATE_SCNAPATTERN.out.profile
+        ch_versions = ch_versions.mix(CALCULATE_SCNAPATTERN.out.versions)
+    }
 
-    ch_versions = ch_versions.mix(CALCULATE_SCNAPATTERN.out.versions)
+    ch_profile_mqc = Channel.empty()
+    if (params.stage_profiling) {
+        SCNAPATTERN_PROFILE_MQC(ch_profiles.collect())
+        ch_profile_mqc = SCNAPATTERN_PROFILE_MQC.out.mqc
+        ch_versions    = ch_versions.mix(SCNAPATTERN_PROFILE_MQC.out.versions)
+    }
+
+    if (params.cohort_store) {
+        // Upsert this run's samples into the persistent cohort store
+        file(params.cohort_store).parent.mkdirs()
+        SCNAPATTERN_COHORT_STORE(
+            ch_tables.map{ meta, filepath -> filepath }.collect(),
+            file(params.cohort_store).toString()
+        )
+        ch_versions = ch_versions.mix(SCNAPATTERN_COHORT_STORE.out.versions)
+    } else {
+        ch_tables.map{ meta, filepath -> filepath }
+                 .collectFile(storeDir: "${params.outdir}/summary/",
+                              name: 'pattern_classification.seg',
+                              keepHeader: true,
+                              skip: 1)
+    }
 
     CUSTOM_DUMPSOFTWAREVERSIONS (
         ch_versions.unique().collectFile(name: 'collated_versions.yml')
@@ -91,6 +156,7 @@ workflow SCNAPATTERN {
     ch_multiqc_files = ch_multiqc_files.mix(ch_workflow_summary.collectFile(name: 'workflow_summary_mqc.yaml'))
     ch_multiqc_files = ch_multiqc_files.mix(ch_methods_description.collectFile(name: 'methods_description_mqc.yaml'))
     ch_multiqc_files = ch_multiqc_files.mix(CUSTOM_DUMPSOFTWAREVERSIONS.out.mqc_yml.collect())
+    ch_multiqc_files = ch_multiqc_files.mix(ch_profile_mqc)
 
     MULTIQC (
         ch_multiqc_files.collect(),